@@ -1,3 +1,6 @@
+import asyncio
+
+import httpx
 import motor
 from beanie import init_beanie
 from fastapi import FastAPI, status
@@ -10,7 +13,7 @@ from starlette.responses import PlainTextResponse
 
 from dspback.config import get_settings
 from dspback.dependencies import RepositoryException
-from dspback.pydantic_schemas import RepositoryToken, Submission, User
+from dspback.pydantic_schemas import RepositoryToken, RepositoryType, Submission, User
 from dspback.routers import (
     authentication,
     discovery,
@@ -21,6 +24,10 @@ from dspback.routers import (
     submissions,
     zenodo,
 )
+from dspback.utils.cache import MongoCache, search_cache
+from dspback.utils.executor import parse_pool
+from dspback.utils.http import http_session, repository_clients
+from dspback.utils.vocabulary import license_vocabulary
 
 app = FastAPI()
 app.add_middleware(SessionMiddleware, secret_key=get_settings().session_secret_key)
@@ -52,6 +59,13 @@ async def http_exception_handler(request, exc):
     return PlainTextResponse(f"Repository exception response[{str(exc.detail)}]", status_code=exc.status_code)
 
 
+@app.exception_handler(httpx.TimeoutException)
+async def repository_timeout_handler(request, exc):
+    return PlainTextResponse(
+        f"Repository exception response[{exc.__class__.__name__}]", status_code=status.HTTP_504_GATEWAY_TIMEOUT
+    )
+
+
 @app.exception_handler(ValidationError)
 async def validation_exception_handler(request, exc: ValidationError):
     return PlainTextResponse(f"Request data validation errors: {str(exc)}", status_code=status.HTTP_400_BAD_REQUEST)
@@ -63,10 +77,30 @@ async def startup_db_client():
     await init_beanie(
         database=app.db[get_settings().mongo_database], document_models=[User, Submission, RepositoryToken]
     )
+    if get_settings().search_cache_backend == "mongo":
+        search_cache.shared = MongoCache(
+            app.db[get_settings().mongo_database]["search_cache"], ttl=get_settings().search_cache_ttl_seconds
+        )
+        await search_cache.shared.create_indexes()
+    # the in-memory discovery indexes are loaded by the discovery trigger, which keeps them current
+    app.index_tasks = []
+    if get_settings().zenodo_license_refresh_hours > 0:
+        client = repository_clients.get(RepositoryType.ZENODO)
+        interval = get_settings().zenodo_license_refresh_hours * 60 * 60
+        app.index_tasks.append(asyncio.create_task(license_vocabulary.refresh_periodically(client, interval)))
 
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # the scheduler and both triggers run in this process and fetch landing pages through the shared session, parsing
+    # them in the pool, so they are stopped before the session and the pool are closed
+    tasks = getattr(app, "background_tasks", []) + getattr(app, "index_tasks", [])
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await repository_clients.close()
+    await http_session.close()
+    parse_pool.shutdown()
     app.db.close()
 
 
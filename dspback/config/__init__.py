@@ -75,6 +75,63 @@ class Settings(BaseSettings):
     access_token_expire_minutes: int = 12 * 60
     access_token_expiration_buffer_seconds: int = 30 * 60
     search_relevance_score_threshold: float = 1.0
+    search_count_threshold: int = 1000
+
+    search_cache_enabled: bool = True
+    search_cache_max_size: int = 512
+    search_cache_ttl_seconds: int = 300
+    # "memory" keeps results in process only, "mongo" also shares them through the search_cache collection
+    search_cache_backend: str = "memory"
+
+    # the in-memory indexes are loaded and kept current by the discovery trigger and only used while it runs
+    # serve /api/discovery/typeahead from memory instead of Atlas Search
+    typeahead_index_enabled: bool = True
+    # serve /api/discovery/creators from memory instead of Atlas Search
+    creator_index_enabled: bool = True
+    # serve /api/discovery/clusters from memory instead of a distinct query
+    cluster_index_enabled: bool = True
+
+    # submissions refreshed at once by the daily scheduler, in total and per repository host
+    daily_concurrency: int = 16
+    daily_host_concurrency: int = 4
+    # discovery record writes sent per bulk_write by the daily scheduler
+    daily_write_batch_size: int = 500
+
+    # discovery change events are applied in batches of up to this many, collected for up to this many seconds
+    discovery_trigger_batch_size: int = 500
+    discovery_trigger_batch_seconds: float = 1.0
+    # submission change events are processed by this many workers, each queueing up to this many before the stream waits
+    submission_trigger_workers: int = 8
+    submission_trigger_queue_size: int = 100
+    # changes to a submission within this many seconds of each other are processed once, with the latest state
+    submission_trigger_debounce_seconds: float = 2.0
+    # a submission change event is tried this many times before it is set aside in the trigger_dead_letters collection
+    submission_trigger_attempts: int = 3
+    # a failed trigger is restarted after this many seconds, doubled after each failure in a row up to the maximum
+    trigger_retry_seconds: float = 1.0
+    trigger_retry_max_seconds: float = 60.0
+
+    # connection pool of the shared outgoing http session
+    http_pool_size: int = 100
+    http_pool_size_per_host: int = 10
+    http_dns_cache_seconds: int = 300
+    http_keepalive_seconds: int = 30
+    # connection pool and timeout of the client used by the metadata routes for each repository
+    repository_pool_size: int = 20
+    repository_timeout_seconds: float = 30.0
+    # build metadata responses after a create or update from the write response when it holds the full record
+    repository_write_through: bool = True
+
+    # Zenodo award vocabulary lookups, numbers not in the vocabulary are remembered for the negative ttl
+    zenodo_award_cache_size: int = 1024
+    zenodo_award_cache_ttl_seconds: int = 24 * 60 * 60
+    zenodo_award_negative_ttl_seconds: int = 60 * 60
+    # hours between refreshes of the Zenodo license vocabulary, with 0 only licenses missing from the bundled snapshot are
+    # fetched
+    zenodo_license_refresh_hours: float = 24
+
+    # worker processes parsing scraped landing pages, 0 parses them in the event loop
+    parse_pool_size: int = 2
 
     session_secret_key: str
 
@@ -96,6 +153,7 @@ class Settings(BaseSettings):
 def get_settings():
     return Settings()
 
+
 # https://docs.authlib.org/en/v0.15.5/client/frameworks.html#using-oauth-2-0-to-log-in
 settings = get_settings()
 config = Config(dotenv_file)
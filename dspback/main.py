@@ -27,6 +27,8 @@ async def main():
         sched = asyncio.create_task(app_rocketry.serve())
         discovery_trigger = asyncio.create_task(watch_discovery_with_retry())
         submissions_trigger = asyncio.create_task(watch_submissions_with_retry())
+        # stopped by the api's shutdown, before it closes the resources they share
+        app_fastapi.background_tasks = [sched, discovery_trigger, submissions_trigger]
 
         await asyncio.wait([api, discovery_trigger, submissions_trigger, sched])
 
@@ -1,21 +1,64 @@
+import asyncio
+import base64
 import functools
-import json
 import re
 from collections import defaultdict
 from datetime import datetime
 
-import pandas
-from fastapi import APIRouter, Query, Request
-from fastapi.responses import FileResponse
+from bson import json_util
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from fuzzywuzzy import fuzz
+from starlette import status
 
 from dspback.config import get_settings
-from dspback.schemas.discovery import PathEnum, TypeAhead
+from dspback.schemas.discovery import CountStrategy, PathEnum, TypeAhead
+from dspback.triggers import discovery_batch_stats, submission_latency
+from dspback.utils.cache import cache_key, search_cache
+from dspback.utils.export import (
+    REPORT_FIELDS,
+    arrow_chunks,
+    csv_chunks,
+    ndjson_chunks,
+    parquet_chunks,
+    report_rows,
+)
+from dspback.utils.jsonld.clusters import cluster_index, compare
+from dspback.utils.jsonld.fingerprint import CONTENT_HASH_FIELD, LANDING_PAGE_FIELD
+from dspback.utils.jsonld.scraper import landing_page_stats
+from dspback.utils.prefix_index import creator_index, typeahead_index
 
 router = APIRouter()
 
 SUPPORTED_REPOSITORIES = ['HydroShare', 'EarthChem Library', 'Zenodo']
 
+SORT_ORDER = {"name": 1, "dateCreated": -1}
+# the database id and the refresh bookkeeping are not part of the search results
+UNSET_STAGE = {'$unset': ['_id', CONTENT_HASH_FIELD, LANDING_PAGE_FIELD]}
+
+
+def cached_search(namespace):
+    """
+    Serves repeated queries from the search cache.  The cache is cleared by the discovery trigger whenever a discovery
+    record changes.
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request: Request, **params):
+            if not get_settings().search_cache_enabled:
+                return await handler(request, **params)
+            key = cache_key(namespace, params)
+            result = await search_cache.get(key)
+            if result is None:
+                result = await search_cache.set(key, await handler(request, **params))
+            return result
+
+        return wrapper
+
+    return decorator
+
+
 def is_one_char_off(str1, str2):
     if str1 == str2:
         return True
@@ -33,21 +76,142 @@ def is_one_char_off(str1, str2):
     return True
 
 
-async def aggregate_stages(request, stages, pageNumber=1, pageSize=30):
+async def aggregate_stages(request, stages, pageNumber=1, pageSize=30, countStrategy=CountStrategy.exact):
+    if countStrategy != CountStrategy.exact:
+        return await aggregate_page_stages(request, stages, pageNumber, pageSize, countStrategy)
+
     # Insert a `$facet` stage to extract the total count. We specify pagination here too.
-    stages.append({"$facet": {"docs": [{"$skip": (pageNumber - 1) * pageSize},
-                                       {"$limit": pageSize}], "totalCount": [{"$count": 'count'}]}})
+    stages = stages + [
+        {
+            "$facet": {
+                "docs": [{"$skip": (pageNumber - 1) * pageSize}, {"$limit": pageSize}],
+                "totalCount": [{"$count": 'count'}],
+            }
+        }
+    ]
 
     aggregation = await request.app.db[get_settings().mongo_database]["discovery"].aggregate(stages).to_list(None)
     total_count = aggregation[0]["totalCount"][0]["count"] if len(aggregation[0]["totalCount"]) else None
 
     if total_count is not None:
         return {"docs": aggregation[0]["docs"], "meta": {"count": {"total": total_count}}}
-    
+
     return {"docs": aggregation[0]["docs"]}
 
 
+async def aggregate_page_stages(request, stages, pageNumber, pageSize, countStrategy):
+    """
+    Retrieves the page without materializing the full result set.  The approximate strategy counts concurrently up to
+    the search_count_threshold setting, the deferred strategy leaves counting to the /count endpoint of the search.
+    """
+    collection = request.app.db[get_settings().mongo_database]["discovery"]
+    page = collection.aggregate(stages + [{"$skip": (pageNumber - 1) * pageSize}, {"$limit": pageSize}])
+    if countStrategy == CountStrategy.deferred:
+        return {"docs": await page.to_list(None)}
+
+    docs, count = await asyncio.gather(page.to_list(None), approximate_count(collection, stages))
+    return {"docs": docs, "meta": {"count": count}}
+
+
+async def approximate_count(collection, stages):
+    """
+    Counts up to the search_count_threshold setting, the count is reported as a lowerBound when the threshold is
+    reached.  `$searchMeta` counts from the search index when no stage after `$search` filters the results.
+    """
+    threshold = get_settings().search_count_threshold
+    filtered = any('$match' in stage for stage in stages)
+    if stages and '$search' in stages[0] and not filtered:
+        search_meta = {key: value for key, value in stages[0]['$search'].items() if key in ('index', 'compound')}
+        search_meta['count'] = {'type': 'lowerBound', 'threshold': threshold}
+        aggregation = await collection.aggregate([{'$searchMeta': search_meta}]).to_list(None)
+        count = aggregation[0]['count']['lowerBound'] if aggregation else 0
+    else:
+        stages = [stage for stage in stages if '$sort' not in stage]
+        aggregation = await collection.aggregate(stages + [{'$limit': threshold}, {'$count': 'count'}]).to_list(None)
+        count = aggregation[0]['count'] if aggregation else 0
+
+    if count < threshold:
+        return {"total": count}
+    return {"lowerBound": count}
+
+
+def encode_cursor(sortBy, after):
+    cursor = json_util.dumps({"sortBy": sortBy, "after": after})
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def decode_cursor(cursor, sortBy):
+    try:
+        decoded = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if not isinstance(decoded, dict) or "after" not in decoded or decoded.get("sortBy") != sortBy:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor does not match the sortBy parameter"
+        )
+    return decoded["after"]
+
+
+def keyset_match(sort_field, after):
+    """
+    Matches the documents that sort after the (sort_field value, _id) position.  Missing values sort first in ascending
+    order and last in descending order.
+    """
+    if sort_field is None:
+        return {'_id': {'$gt': after[0]}}
+    value, _id = after
+    tie = {sort_field: value, '_id': {'$gt': _id}}
+    if SORT_ORDER[sort_field] == 1:
+        if value is None:
+            return {'$or': [tie, {sort_field: {'$ne': None}}]}
+        return {'$or': [{sort_field: {'$gt': value}}, tie]}
+    if value is None:
+        return tie
+    return {'$or': [{sort_field: {'$lt': value}}, tie, {sort_field: None}]}
+
+
+async def aggregate_cursor_stages(request, stages, sortBy=None, cursor=None, pageSize=30):
+    """
+    Keyset pagination, each page picks up where the cursor left off so page N costs the same as page 1.  Atlas Search
+    queries continue with `searchAfter`, other queries continue after the last (sort field, _id) returned.  No total
+    count is computed.
+    """
+    after = decode_cursor(cursor, sortBy) if cursor else None
+    sort_field = sortBy if sortBy in SORT_ORDER else None
+    stages = [stage for stage in stages if '$sort' not in stage]
+
+    if stages and '$search' in stages[0]:
+        search = dict(stages[0]['$search'])
+        sort = {sort_field: SORT_ORDER[sort_field]} if sort_field else {'score': {'$meta': 'searchScore', 'order': -1}}
+        sort['_id'] = 1
+        search['sort'] = sort
+        if after:
+            search['searchAfter'] = after
+        stages[0] = {'$search': search}
+        stages.append({'$set': {'_cursor': {'$meta': 'searchSequenceToken'}}})
+    else:
+        sort = {sort_field: SORT_ORDER[sort_field], '_id': 1} if sort_field else {'_id': 1}
+        cursor_value = ['$' + sort_field, '$_id'] if sort_field else ['$_id']
+        unset_index = stages.index(UNSET_STAGE)
+        stages[unset_index:unset_index] = [{'$sort': sort}, {'$set': {'_cursor': cursor_value}}]
+        if after:
+            stages.insert(0, {'$match': keyset_match(sort_field, after)})
+    stages.append({'$limit': pageSize})
+
+    docs = await request.app.db[get_settings().mongo_database]["discovery"].aggregate(stages).to_list(None)
+    positions = [doc.pop('_cursor', None) for doc in docs]
+    next_cursor = encode_cursor(sortBy, positions[-1]) if len(docs) == pageSize else None
+    return {"docs": docs, "meta": {"cursor": next_cursor}}
+
+
+async def paginate_stages(request, stages, sortBy, pageNumber, pageSize, useCursor, cursor, countStrategy):
+    if useCursor or cursor:
+        return await aggregate_cursor_stages(request, stages, sortBy, cursor, pageSize)
+    return await aggregate_stages(request, stages, pageNumber, pageSize, countStrategy)
+
+
 @router.get("/search")
+@cached_search("search")
 async def search(
     request: Request,
     term: str = None,
@@ -62,6 +226,74 @@ async def search(
     clusters: list[str] | None = Query(default=None),
     pageNumber: int = 1,
     pageSize: int = 30,
+    useCursor: bool = False,
+    cursor: str = None,
+    countStrategy: CountStrategy = CountStrategy.exact,
+):
+    stages = await search_stages(
+        term,
+        clusters,
+        contentType,
+        creatorName,
+        dataCoverageEnd,
+        dataCoverageStart,
+        providerName,
+        publishedEnd,
+        publishedStart,
+        sortBy,
+    )
+    return await paginate_stages(request, stages, sortBy, pageNumber, pageSize, useCursor, cursor, countStrategy)
+
+
+@router.get("/search/count")
+@cached_search("search_count")
+async def search_count(
+    request: Request,
+    term: str = None,
+    contentType: str = None,
+    providerName: str = None,
+    creatorName: str = None,
+    dataCoverageStart: int = None,
+    dataCoverageEnd: int = None,
+    publishedStart: int = None,
+    publishedEnd: int = None,
+    clusters: list[str] | None = Query(default=None),
+):
+    """
+    The total count of /search results, for clients paging with the deferred count strategy.
+    """
+    stages = await search_stages(
+        term,
+        clusters,
+        contentType,
+        creatorName,
+        dataCoverageEnd,
+        dataCoverageStart,
+        providerName,
+        publishedEnd,
+        publishedStart,
+        None,
+    )
+    return await count_stages(request, stages)
+
+
+async def count_stages(request, stages):
+    stages = stages + [{'$count': 'count'}]
+    aggregation = await request.app.db[get_settings().mongo_database]["discovery"].aggregate(stages).to_list(None)
+    return {"count": {"total": aggregation[0]["count"] if aggregation else 0}}
+
+
+async def search_stages(
+    term,
+    clusters,
+    contentType,
+    creatorName,
+    dataCoverageEnd,
+    dataCoverageStart,
+    providerName,
+    publishedEnd,
+    publishedStart,
+    sortBy,
 ):
     filters, must, search_paths, stages = await base_search(
         clusters,
@@ -102,10 +334,11 @@ async def search(
         score_threshold = get_settings().search_relevance_score_threshold
         stages.append({'$match': {'score': {'$gt': score_threshold}}})
 
-    return await aggregate_stages(request, stages, pageNumber, pageSize)
+    return stages
 
 
 @router.get("/search/fuzzy")
+@cached_search("search_fuzzy")
 async def search(
     request: Request,
     term: str,
@@ -120,6 +353,71 @@ async def search(
     clusters: list[str] | None = Query(default=None),
     pageNumber: int = 1,
     pageSize: int = 30,
+    useCursor: bool = False,
+    cursor: str = None,
+    countStrategy: CountStrategy = CountStrategy.exact,
+):
+    stages = await fuzzy_search_stages(
+        term,
+        True,
+        clusters,
+        contentType,
+        creatorName,
+        dataCoverageEnd,
+        dataCoverageStart,
+        providerName,
+        publishedEnd,
+        publishedStart,
+        sortBy,
+    )
+    return await paginate_stages(request, stages, sortBy, pageNumber, pageSize, useCursor, cursor, countStrategy)
+
+
+@router.get("/search/fuzzy/count")
+@cached_search("search_fuzzy_count")
+async def search_fuzzy_count(
+    request: Request,
+    term: str,
+    contentType: str = None,
+    providerName: str = None,
+    creatorName: str = None,
+    dataCoverageStart: int = None,
+    dataCoverageEnd: int = None,
+    publishedStart: int = None,
+    publishedEnd: int = None,
+    clusters: list[str] | None = Query(default=None),
+):
+    """
+    The total count of /search/fuzzy results, for clients paging with the deferred count strategy.
+    """
+    stages = await fuzzy_search_stages(
+        term,
+        True,
+        clusters,
+        contentType,
+        creatorName,
+        dataCoverageEnd,
+        dataCoverageStart,
+        providerName,
+        publishedEnd,
+        publishedStart,
+        None,
+    )
+    return await count_stages(request, stages)
+
+
+async def fuzzy_search_stages(
+    term,
+    fuzzy,
+    clusters,
+    contentType,
+    creatorName,
+    dataCoverageEnd,
+    dataCoverageStart,
+    providerName,
+    publishedEnd,
+    publishedStart,
+    sortBy,
 ):
     filters, must, search_paths, stages = await base_search(
         clusters,
@@ -133,7 +431,10 @@ async def search(
         sortBy,
     )
 
-    should = [{'autocomplete': {'query': term, 'path': key, 'fuzzy': {'maxEdits': 1}}} for key in search_paths]
+    if fuzzy:
+        should = [{'autocomplete': {'query': term, 'path': key, 'fuzzy': {'maxEdits': 1}}} for key in search_paths]
+    else:
+        should = [{'autocomplete': {'query': term, 'path': key}} for key in search_paths]
 
     stages.insert(
         0,
@@ -145,12 +446,11 @@ async def search(
             }
         },
     )
-
-    return await aggregate_stages(request, stages, pageNumber, pageSize)
-
+    return stages
 
 
 @router.get("/search/fuzzy/feedback")
+@cached_search("search_fuzzy_feedback")
 async def search_fuzzy_feedback(
     request: Request,
     term: str,
@@ -165,8 +465,11 @@ async def search_fuzzy_feedback(
     clusters: list[str] | None = Query(default=None),
     pageNumber: int = 1,
     pageSize: int = 30,
+    useCursor: bool = False,
+    cursor: str = None,
+    countStrategy: CountStrategy = CountStrategy.exact,
 ):
-    filters, must, search_paths, stages = await base_search(
+    params = (
         clusters,
         contentType,
         creatorName,
@@ -177,34 +480,75 @@ async def search_fuzzy_feedback(
         publishedStart,
         sortBy,
     )
-
-    should = [{'autocomplete': {'query': term, 'path': key}} for key in search_paths]
-
-    stages.insert(
-        0,
-        {
-            '$search': {
-                'index': 'fuzzy_search',
-                'compound': {'filter': filters, 'should': should, 'must': must, 'minimumShouldMatch': 1},
-                'highlight': {'path': search_paths},
-            }
-        },
-    )
-
-    results = await aggregate_stages(request, stages, pageNumber, pageSize)
+    stages = await fuzzy_search_stages(term, False, *params)
+    results = await paginate_stages(request, stages, sortBy, pageNumber, pageSize, useCursor, cursor, countStrategy)
 
     if len(results["docs"]) == 0:
-        fuzzy_should = [
-            {'autocomplete': {'query': term, 'path': key, 'fuzzy': {'maxEdits': 1}}} for key in search_paths
-        ]
-        stages[0]['$search']['compound']['should'] = fuzzy_should
-        results = await aggregate_stages(request, stages, pageNumber, pageSize)
+        stages = await fuzzy_search_stages(term, True, *params)
+        results = await paginate_stages(request, stages, sortBy, pageNumber, pageSize, useCursor, cursor, countStrategy)
         result_hits = await determine_fuzzy_result_terms(results["docs"], term)
         return {"results": results, "fuzzy_search_terms": result_hits}
 
     return {"results": results, "fuzzy_search_terms": {}}
 
 
+@router.get("/search/fuzzy/feedback/count")
+@cached_search("search_fuzzy_feedback_count")
+async def search_fuzzy_feedback_count(
+    request: Request,
+    term: str,
+    contentType: str = None,
+    providerName: str = None,
+    creatorName: str = None,
+    dataCoverageStart: int = None,
+    dataCoverageEnd: int = None,
+    publishedStart: int = None,
+    publishedEnd: int = None,
+    clusters: list[str] | None = Query(default=None),
+):
+    """
+    The total count of /search/fuzzy/feedback results, which fall back to the fuzzy search when the search has none.
+    """
+    params = (
+        clusters,
+        contentType,
+        creatorName,
+        dataCoverageEnd,
+        dataCoverageStart,
+        providerName,
+        publishedEnd,
+        publishedStart,
+        None,
+    )
+    count = await count_stages(request, await fuzzy_search_stages(term, False, *params))
+    if count["count"]["total"] == 0:
+        count = await count_stages(request, await fuzzy_search_stages(term, True, *params))
+    return count
+
+
+@router.get("/search/cache")
+async def search_cache_stats():
+    return search_cache.stats()
+
+
+@router.get("/search/triggers")
+async def search_trigger_stats():
+    """
+    The change event batches the discovery trigger applied to the typeahead collection and search indexes, and the
+    latency of the submission trigger's discovery record writes
+    """
+    return {"discovery": discovery_batch_stats.stats(), "submissions": submission_latency.stats()}
+
+
+@router.get("/search/landing-pages")
+async def search_landing_page_stats():
+    """
+    The conditional landing page requests of the latest discovery refresh by repository, and how many of them the
+    repository answered with 304 Not Modified
+    """
+    return landing_page_stats.stats()
+
+
 async def base_search(
     clusters,
     contentType,
@@ -254,12 +598,10 @@ async def base_search(
     if clusters:
         stages.append({'$match': {'clusters': {'$all': clusters}}})
     # Sort needs to happen before pagination, ignore all other values of sortBy
-    if sortBy == "name":
-        stages.append({'$sort': {"name": 1}})
-    if sortBy == "dateCreated":
-        stages.append({'$sort': {"dateCreated": -1}})
+    if sortBy in SORT_ORDER:
+        stages.append({'$sort': {sortBy: SORT_ORDER[sortBy]}})
 
-    stages.append({'$unset': ['_id']})
+    stages.append(UNSET_STAGE)
     stages.append(
         {'$set': {'score': {'$meta': 'searchScore'}, 'highlights': {'$meta': 'searchHighlights'}}},
     )
@@ -305,6 +647,9 @@ async def determine_fuzzy_result_terms(results, term):
 
 @router.get("/typeahead", response_model=list[TypeAhead])
 async def typeahead(request: Request, term: str, pageSize: int = 30):
+    if typeahead_index.ready:
+        return typeahead_index.search(term, pageSize)
+
     search_terms = PathEnum.values()
 
     should = [{'autocomplete': {'query': term, 'path': key, 'fuzzy': {'maxEdits': 1}}} for key in search_terms]
@@ -333,6 +678,9 @@ async def typeahead(request: Request, term: str, pageSize: int = 30):
 
 @router.get("/creators")
 async def creator_search(request: Request, name: str, pageSize: int = 30) -> list[str]:
+    if creator_index.ready:
+        return creator_index.search(name, pageSize)
+
     stages = [
         {
             '$search': {
@@ -359,33 +707,49 @@ async def creator_search(request: Request, name: str, pageSize: int = 30) -> lis
 
 
 async def build_report(request: Request):
-    project = [
-        {
-            '$project': {
-                'name': 1,
-                'description': 1,
-                'keywords': 1,
-                'datePublished': 1,
-                'dateCreated': 1,
-                'provider': 1,
-                'funding': 1,
-                'clusters': 1,
-                'url': 1,
-                'legacy': 1,
-                '_id': 0,
-            }
-        }
-    ]
-    json_response = await request.app.db[get_settings().mongo_database]["discovery"].aggregate(project).to_list(None)
-    for row in json_response:
-        row['provider'] = row['provider']['name']
-        if 'funding' in row:
-            funding_ids = []
-            for funding in row['funding']:
-                if 'identifier' in funding:
-                    funding_ids.append(funding['identifier'])
-            row['funding'] = funding_ids
-    return json_response
+    collection = request.app.db[get_settings().mongo_database]["discovery"]
+    return [row async for row in report_rows(collection)]
+
+
+async def report_filters(
+    contentType: str = None,
+    providerName: str = None,
+    creatorName: str = None,
+    dataCoverageStart: int = None,
+    dataCoverageEnd: int = None,
+    publishedStart: int = None,
+    publishedEnd: int = None,
+    clusters: list[str] | None = Query(default=None),
+    fields: list[str] | None = Query(default=None),
+):
+    """
+    The /search filters and a field projection for the bulk report exports.
+    """
+    if fields and not set(fields).issubset(REPORT_FIELDS):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields {sorted(set(fields) - set(REPORT_FIELDS))}, available fields are {REPORT_FIELDS}",
+        )
+    stages = await search_stages(
+        None,
+        clusters,
+        contentType,
+        creatorName,
+        dataCoverageEnd,
+        dataCoverageStart,
+        providerName,
+        publishedEnd,
+        publishedStart,
+        None,
+    )
+    # drop the search score and highlights, the report projection follows
+    stages = [stage for stage in stages if '$set' not in stage and '$unset' not in stage]
+    return stages, fields
+
+
+def report_rows_for(request: Request, filters):
+    stages, fields = filters
+    return report_rows(request.app.db[get_settings().mongo_database]["discovery"], stages, fields)
 
 
 @router.get("/json")
@@ -395,25 +759,51 @@ async def report_json(request: Request):
 
 @router.get("/csv")
 async def csv(request: Request):
-    json_response = await build_report(request)
-    df = pandas.read_json(json.dumps(json_response, default=str))
-    filename = "discover_report.csv"
-    df.to_csv(filename)
-    return FileResponse(filename, filename=filename, media_type='application/octet-stream')
+    rows = report_rows(request.app.db[get_settings().mongo_database]["discovery"])
+    return StreamingResponse(
+        csv_chunks(rows),
+        media_type='text/csv',
+        headers={'Content-Disposition': 'attachment; filename="discover_report.csv"'},
+    )
 
 
-def compare(c1: str, c2: str):
-    if c1.startswith("CZO"):
-        if c2.startswith("CZO"):
-            return c1 < c2
-        else:
-            return 1
-    if c2.startswith("CZO"):
-        return -1
-    return c1 < c2
+@router.get("/ndjson")
+async def report_ndjson(request: Request, filters=Depends(report_filters)):
+    return StreamingResponse(ndjson_chunks(report_rows_for(request, filters)), media_type='application/x-ndjson')
+
+
+@router.get("/parquet")
+async def report_parquet(request: Request, filters=Depends(report_filters)):
+    _, fields = filters
+    return StreamingResponse(
+        parquet_chunks(report_rows_for(request, filters), fields),
+        media_type='application/vnd.apache.parquet',
+        headers={'Content-Disposition': 'attachment; filename="discover_report.parquet"'},
+    )
+
+
+@router.get("/arrow")
+async def report_arrow(request: Request, filters=Depends(report_filters)):
+    _, fields = filters
+    return StreamingResponse(
+        arrow_chunks(report_rows_for(request, filters), fields),
+        media_type='application/vnd.apache.arrow.stream',
+        headers={'Content-Disposition': 'attachment; filename="discover_report.arrows"'},
+    )
 
 
 @router.get("/clusters")
 async def clusters(request: Request) -> list[str]:
+    if cluster_index.ready:
+        return cluster_index.sorted_clusters
     existing_clusters = await request.app.db[get_settings().mongo_database]["discovery"].find().distinct('clusters')
     return sorted(existing_clusters, key=functools.cmp_to_key(compare))
+
+
+@router.get("/clusters/counts")
+async def cluster_counts(request: Request) -> dict[str, int]:
+    if cluster_index.ready:
+        return cluster_index.counts
+    stages = [{'$unwind': '$clusters'}, {'$group': {'_id': '$clusters', 'count': {'$sum': 1}}}]
+    aggregation = await request.app.db[get_settings().mongo_database]["discovery"].aggregate(stages).to_list(None)
+    return {cluster["_id"]: cluster["count"] for cluster in aggregation}
@@ -1,6 +1,5 @@
 import json
 
-import requests
 from fastapi import Request
 from fastapi_restful.cbv import cbv
 from fastapi_restful.inferring_router import InferringRouter
@@ -50,7 +49,7 @@ class EarthChemMetadataRoutes(MetadataRoutes):
     async def create_metadata_repository(self, request: Request, metadata: request_model) -> response_model:
         access_token = await self.access_token(request)
         json_metadata = prepare_metadata_for_ecl(json.loads(metadata.json(exclude_none=True)))
-        response = requests.post(
+        response = await self.http.post(
             self.create_url,
             json=json_metadata,
             headers={
@@ -65,7 +64,9 @@ class EarthChemMetadataRoutes(MetadataRoutes):
             raise RepositoryException(status_code=response.status_code, detail=response.text)
 
         identifier = response.json()["id"]
-        json_metadata = await self.get_metadata_repository(request, identifier)
+        json_metadata = await self._write_through(request, identifier, response)
+        if json_metadata is None:
+            json_metadata = await self.get_metadata_repository(request, identifier)
 
         return JSONResponse(json_metadata, status_code=201)
 
@@ -83,7 +84,7 @@ class EarthChemMetadataRoutes(MetadataRoutes):
         earthchem_metadata = prepare_metadata_for_ecl(json_metadata)
 
         access_token = await self.access_token(request)
-        response = requests.put(
+        response = await self.http.put(
             self.update_url % identifier,
             json=earthchem_metadata,
             headers={"Content-Type": "application/json", "Authorization": "Bearer " + str(access_token)},
@@ -92,11 +93,31 @@ class EarthChemMetadataRoutes(MetadataRoutes):
         if response.status_code >= 300:
             raise RepositoryException(status_code=response.status_code, detail=response.text)
 
-        return await self.get_metadata_repository(request, identifier)
+        json_metadata = await self._write_through(request, identifier, response)
+        if json_metadata is None:
+            json_metadata = await self.get_metadata_repository(request, identifier)
+        return json_metadata
+
+    async def _write_through(self, request: Request, identifier, response):
+        """
+        Submits the record returned by a write, returns None when the write response does not hold the full record
+        and it has to be read back.
+        """
+        if not self.write_through:
+            return None
+        try:
+            record = response.json()
+        except ValueError:
+            return None
+        if not isinstance(record, dict) or "title" not in record or "contributors" not in record:
+            return None
+        json_metadata = self._from_repository_format(record)
+        await self.submit(request, identifier=identifier, json_metadata=json_metadata)
+        return json_metadata
 
     async def _retrieve_metadata_from_repository(self, request: Request, identifier):
         access_token = await self.access_token(request)
-        response = requests.get(
+        response = await self.http.get(
             self.read_url % identifier,
             headers={"accept": "application/json", "Authorization": "Bearer " + str(access_token)},
         )
@@ -104,8 +125,10 @@ class EarthChemMetadataRoutes(MetadataRoutes):
         if response.status_code >= 300:
             raise RepositoryException(status_code=response.status_code, detail=response.text)
 
+        return self._from_repository_format(json.loads(response.text))
+
+    def _from_repository_format(self, json_metadata: dict):
         # split first contributors to leadAuthor
-        json_metadata = json.loads(response.text)
         if "contributors" in json_metadata:
             all_contributors = json_metadata["contributors"]
             for contributor in json_metadata["contributors"]:
@@ -151,7 +174,7 @@ class EarthChemMetadataRoutes(MetadataRoutes):
         await delete_submission(identifier, self.user)
 
         access_token = await self.access_token(request)
-        response = requests.delete(
+        response = await self.http.delete(
             self.delete_url % str(identifier),
             headers={"accept": "application/json", "Authorization": "Bearer " + str(access_token)},
         )
@@ -1,6 +1,5 @@
 import json
 
-import requests
 from fastapi import Request
 from fastapi_restful.cbv import cbv
 from fastapi_restful.inferring_router import InferringRouter
@@ -92,7 +91,7 @@ class HydroShareMetadataRoutes(MetadataRoutes):
     )
     async def create_metadata_repository(self, request: Request, metadata: request_model):
         access_token = await self.access_token(request)
-        response = requests.post(
+        response = await self.http.post(
             self.create_url,
             params={"access_token": access_token},
             headers={"Content-Type": "application/json"},
@@ -109,7 +108,14 @@ class HydroShareMetadataRoutes(MetadataRoutes):
         new_md = await self._retrieve_metadata_from_repository(request, identifier)
         metadata.creators = metadata.creators or new_md["metadata"]["creators"]
         metadata.citation = new_md["metadata"]["citation"]
-        json_metadata = await self.update_metadata(request, metadata, identifier)
+        if self.write_through:
+            await self._write_metadata(request, metadata, identifier)
+            # the new resource as read before the update, with the metadata the update wrote.  The rdf is written from
+            # the full metadata, fields left unset are cleared on the resource so they are merged as well
+            new_md["metadata"].update(json.loads(metadata.json()))
+            json_metadata = await self.submit(request, identifier, json_metadata=new_md)
+        else:
+            json_metadata = await self.update_metadata(request, metadata, identifier)
 
         return JSONResponse(json_metadata, status_code=201)
 
@@ -122,25 +128,27 @@ class HydroShareMetadataRoutes(MetadataRoutes):
         description="Validates the incoming metadata and updates the HydroShare resource associated with the provided identifier.",
     )
     async def update_metadata(self, request: Request, metadata: request_model, identifier):
+        await self._write_metadata(request, metadata, identifier)
+        json_metadata = await self.submit(request, identifier)
+        return json_metadata
+
+    async def _write_metadata(self, request: Request, metadata: request_model, identifier):
         access_token = await self.access_token(request)
         metadata_json = to_hydroshare_format(json.loads(metadata.json()))
         url = self.settings.hydroshare_view_url % identifier
         rdf = rdf_string(Res_MD(**metadata_json, identifier=url, url=url))
-        response = requests.post(
+        response = await self.http.post(
             self.update_url % identifier,
-            files={'file': ("resourcemetadata.xml", rdf)},
+            files={'file': ("resourcemetadata.xml", rdf.encode())},
             params={"access_token": access_token},
         )
 
         if response.status_code >= 300:
             raise RepositoryException(status_code=response.status_code, detail=response.text)
 
-        json_metadata = await self.submit(request, identifier)
-        return json_metadata
-
     async def _retrieve_metadata_from_repository(self, request: Request, identifier):
         access_token = await self.access_token(request)
-        response = requests.get(self.read_url % identifier, params={"access_token": access_token})
+        response = await self.http.get(self.read_url % identifier, params={"access_token": access_token})
         if response.status_code >= 300:
             raise RepositoryException(status_code=response.status_code, detail=response.text)
 
@@ -191,7 +199,7 @@ class HydroShareMetadataRoutes(MetadataRoutes):
         await delete_submission(identifier, self.user)
 
         access_token = await self.access_token(request)
-        response = requests.delete(self.delete_url % identifier, params={"access_token": access_token})
+        response = await self.http.delete(self.delete_url % identifier, params={"access_token": access_token})
 
         if response.status_code >= 300:
             raise RepositoryException(status_code=response.status_code, detail=response.text)
@@ -6,6 +6,7 @@ from dspback.config import Settings, get_settings, repository_config
 from dspback.dependencies import get_current_repository_token, get_current_user
 from dspback.pydantic_schemas import User
 from dspback.routers.submissions import submit_record
+from dspback.utils.http import repository_clients
 
 router = InferringRouter()
 
@@ -32,6 +33,16 @@ class MetadataRoutes:
         repository_token = await get_current_repository_token(request, self.repository_type, self.user, self.settings)
         return repository_token.access_token
 
+    @property
+    def write_through(self) -> bool:
+        """Build the response and submission of a write from the write response instead of reading the record back"""
+        return self.settings.repository_write_through
+
+    @property
+    def http(self):
+        """The pooled async client for calls to the repository"""
+        return repository_clients.get(self.repository_type)
+
     def wrap_metadata(self, metadata: dict, published: bool):
         return {"metadata": metadata, "published": published}
 
@@ -1,18 +1,17 @@
 import json
 
-import requests
 from fastapi import Request
 from fastapi_restful.cbv import cbv
 from fastapi_restful.inferring_router import InferringRouter
 from pydantic import BaseModel
 from starlette.responses import JSONResponse
-from urllib.parse import quote
 
 from dspback.database.procedures import delete_submission
 from dspback.dependencies import RepositoryException
 from dspback.pydantic_schemas import RepositoryType, Submission
 from dspback.routers.metadata_class import MetadataRoutes, exists_and_is
 from dspback.schemas.zenodo.model import ZenodoDatasetsSchemaForCzNetV100
+from dspback.utils.vocabulary import award_vocabulary, license_vocabulary
 
 router = InferringRouter()
 
@@ -60,7 +59,7 @@ class ZenodoMetadataRoutes(MetadataRoutes):
         metadata_json = json.loads(metadata.json(exclude_none=True))
         metadata_json = to_zenodo_format(metadata_json)
         access_token = await self.access_token(request)
-        response = requests.post(
+        response = await self.http.post(
             self.create_url,
             json=metadata_json,
             params={"access_token": access_token},
@@ -72,7 +71,11 @@ class ZenodoMetadataRoutes(MetadataRoutes):
             raise RepositoryException(status_code=response.status_code, detail=response.text)
 
         identifier = response.json()["record_id"]
-        json_metadata = await self.get_metadata_repository(request, identifier)
+        if self.write_through:
+            # the deposition returned by the create is the record as a read would return it
+            json_metadata = await self._write_through(request, identifier, response.json())
+        else:
+            json_metadata = await self.get_metadata_repository(request, identifier)
 
         return JSONResponse(json_metadata, status_code=201)
 
@@ -88,7 +91,7 @@ class ZenodoMetadataRoutes(MetadataRoutes):
         incoming_metadata = metadata.json(skip_defaults=True, exclude_unset=True)
         zenodo_metadata = to_zenodo_format(json.loads(incoming_metadata))
         access_token = await self.access_token(request)
-        response = requests.put(
+        response = await self.http.put(
             self.update_url % identifier,
             json=zenodo_metadata,
             headers={"Content-Type": "application/json"},
@@ -98,22 +101,30 @@ class ZenodoMetadataRoutes(MetadataRoutes):
         if response.status_code >= 300:
             raise RepositoryException(status_code=response.status_code, detail=response.text)
 
+        if self.write_through:
+            return await self._write_through(request, identifier, response.json())
         return await self.get_metadata_repository(request, identifier)
 
+    async def _write_through(self, request: Request, identifier, deposition: dict):
+        json_metadata = await self._resolve_vocabularies(deposition)
+        await self.submit(request, identifier=identifier, json_metadata=json_metadata)
+        return from_zenodo_format(json_metadata)
+
     async def _retrieve_metadata_from_repository(self, request: Request, identifier):
         access_token = await self.access_token(request)
-        response = requests.get(self.read_url % identifier, params={"access_token": access_token})
+        response = await self.http.get(self.read_url % identifier, params={"access_token": access_token})
 
         if response.status_code >= 300:
-            response = requests.get(
+            response = await self.http.get(
                 self.settings.zenodo_published_read_url % identifier, params={"access_token": access_token}
             )
 
         if response.status_code >= 300:
             raise RepositoryException(status_code=response.status_code, detail=response.text)
 
-        json_metadata = json.loads(response.text)
-        
+        return await self._resolve_vocabularies(json.loads(response.text))
+
+    async def _resolve_vocabularies(self, json_metadata: dict):
         # ==== GRANTS ====
         # Zenodo only returns an grant id as a string that references their vocabulary.
         # The grant metadata returned by zenodo is useless, as the id they return might not match their vocabulary.
@@ -123,6 +134,7 @@ class ZenodoMetadataRoutes(MetadataRoutes):
         except Exception as exp:
             grants = []
 
+        numbers = []
         for grant in grants:
             # Grant metadata coming from their 'records' url have different properties. The grant id will the 'code' property
             number = None
@@ -130,25 +142,16 @@ class ZenodoMetadataRoutes(MetadataRoutes):
                 number = grant["id"].split("::")[-1]
             elif "code" in grant:
                 number = grant["code"]
+            numbers.append(number)
 
+        # all grants are looked up at once, repeated award numbers are served from the cache
+        awards = await award_vocabulary.resolve(self.http, numbers)
+        for grant, number in zip(grants, numbers):
             # We will filter out the ones not found later
             grant["id"] = None
-            
-            try:
-                response = requests.get("https://zenodo.org/api/awards?q=" + quote(number, safe=''))
-                response_json = json.loads(response.text)
-                results = response_json['hits']['hits']
-
-                for result in results:
-                    if result['number'] == number:
-                        # Populate the schema fields
-                        grant["id"] = result['id']
-                        grant["number"] = result['number']
-                        grant["title"] = result['title']['en']
-                        grant["fundingAgency"] = result['funder']['name']
-                        break
-            except Exception as exp:
-                continue
+            if number in awards:
+                # Populate the schema fields
+                grant.update(awards[number])
 
         # Filter out the ones not found in vocabulary search
         if len(grants) > 0:
@@ -157,7 +160,8 @@ class ZenodoMetadataRoutes(MetadataRoutes):
         # ==== LICENSE ====
         # Similarly, Zenodo only returns the selected license as an id string reference to their vocabulary.
         # This id is not even guaranteed to match the one in their vocabulary.
-        # Attempt to fetch the rest of the license metadata.
+        # Look up the rest of the license metadata in the in-memory copy of the vocabulary, licenses missing from it
+        # are fetched from Zenodo.
         # Example vocabulary entry: https://zenodo.org/api/vocabularies/licenses/glide
 
         # default license
@@ -171,18 +175,13 @@ class ZenodoMetadataRoutes(MetadataRoutes):
         try:
             license_id = json_metadata['metadata']['license']
             if license_id:
-                response = requests.get("https://zenodo.org/api/vocabularies/licenses/" + quote(license_id, safe=''))
-                result = json.loads(response.text)
-                license["id"] = result['id']
-                license["name"] = result['title']['en']
-                license["description"] = result['description']['en']
-                license["url"] = result['props']['url']
-            
+                license = await license_vocabulary.lookup(self.http, license_id) or license
+
         except Exception as exp:
             pass
 
         json_metadata['metadata']['license'] = license
-        
+
         return self.wrap_metadata(json_metadata, exists_and_is("doi", json_metadata["metadata"]))
 
     @router.get(
@@ -220,7 +219,7 @@ class ZenodoMetadataRoutes(MetadataRoutes):
         await delete_submission(identifier, self.user)
 
         access_token = await self.access_token(request)
-        response = requests.delete(self.delete_url % identifier, params={"access_token": access_token})
+        response = await self.http.delete(self.delete_url % identifier, params={"access_token": access_token})
         if response.status_code >= 300:
             raise RepositoryException(status_code=response.status_code, detail=response.text)
 
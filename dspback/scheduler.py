@@ -1,16 +1,23 @@
+import asyncio
 import json
 import logging
 import re
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlparse
 
 import motor
 from beanie import init_beanie
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from rocketry import Rocketry
 from rocketry.conds import daily
 
 from dspback.config import get_settings
 from dspback.pydantic_schemas import ExternalRecord, RepositoryType, Submission
 from dspback.utils.jsonld.clusters import clusters
-from dspback.utils.jsonld.scraper import retrieve_discovery_jsonld
+from dspback.utils.jsonld.fingerprint import CONTENT_HASH_FIELD, LANDING_PAGE_FIELD, content_hash
+from dspback.utils.jsonld.scraper import NotModified, landing_page_stats, retrieve_discovery_jsonld
 from dspback.schemas.discovery import Funding
 
 app = Rocketry(config={"task_execution": "async"})
@@ -37,10 +44,10 @@ async def parse_submission_notes_for_funding(public_json_ld, metadata_json):
             public_json_ld["funding"] = all_funding
 
 
-async def retrieve_submission_json_ld(submission):
+async def retrieve_submission_json_ld(submission, validators: dict = None):
     if submission["repo_type"] != RepositoryType.EXTERNAL:
         public_json_ld = await retrieve_discovery_jsonld(
-            submission["identifier"], submission["repo_type"], submission["url"]
+            submission["identifier"], submission["repo_type"], submission["url"], validators
         )
     else:
         public_json_ld = (
@@ -52,36 +59,186 @@ async def retrieve_submission_json_ld(submission):
         if submission["repo_type"] == RepositoryType.ZENODO:
             await parse_submission_notes_for_funding(public_json_ld, submission["metadata_json"])
         public_json_ld["clusters"] = clusters(public_json_ld)
+        public_json_ld[CONTENT_HASH_FIELD] = content_hash(public_json_ld)
     return public_json_ld
 
 
-@app.task(daily)
-async def do_daily():
-    db = motor.motor_asyncio.AsyncIOMotorClient(get_settings().mongo_url)[get_settings().mongo_database]
-    await init_beanie(database=db, document_models=[Submission])
+async def sweep_orphans(submissions, discovery) -> int:
+    """
+    Removes the non-legacy discovery records whose submission no longer exists, returns the number removed.
+    """
+    identifiers = {submission["identifier"] async for submission in submissions.find({}, {"identifier": 1, "_id": 0})}
+    records = discovery.find({"legacy": False}, {"repository_identifier": 1, "_id": 0})
+    orphans = {record["repository_identifier"] async for record in records} - identifiers
+    if not orphans:
+        return 0
+    result = await discovery.delete_many({"repository_identifier": {"$in": list(orphans)}, "legacy": False})
+    logger.info(f"Removed {result.deleted_count} discovery records without a submission")
+    return result.deleted_count
+
+
+async def discovery_fingerprints(discovery) -> dict:
+    """
+    The content hash and landing page validators of every non-legacy discovery record by repository identifier.
+    """
+    projection = {"repository_identifier": 1, CONTENT_HASH_FIELD: 1, LANDING_PAGE_FIELD: 1, "_id": 0}
+    records = discovery.find({"legacy": False}, projection)
+    return {record.pop("repository_identifier"): record async for record in records}
+
+
+class DiscoveryWriter:
+    """
+    Collects the discovery record replacements and deletions of a refresh and writes them with unordered bulk_write
+    calls of batch_size operations.  Given the stored fingerprints, records that would not change are not written, so
+    they do not set off the discovery trigger.
+    """
+
+    key_name = "repository_identifier"
 
-    async for jsonld in db["discovery"].find({"legacy": False}):
-        submission = await Submission.find_one(Submission.identifier == jsonld["repository_identifier"])
-        if not submission:
-            # remove
-            await db["discovery"].delete_one(
-                {"repository_identifier": jsonld["repository_identifier"], "legacy": False}
-            )
+    def __init__(self, collection, batch_size: int = 500, fingerprints: dict = None):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.fingerprints = fingerprints
+        self.operations = []
+        self.written = 0
+        self.failed = 0
 
-    async for submission in Submission.find_all():
+    def validators(self, identifier: str):
+        """The stored landing page validators, only for records that exist"""
+        return ((self.fingerprints or {}).get(identifier) or {}).get(LANDING_PAGE_FIELD)
+
+    async def replace(self, public_json_ld: dict) -> bool:
+        identifier = public_json_ld[self.key_name]
+        stored = (self.fingerprints or {}).get(identifier)
+        if stored is None or stored.get(CONTENT_HASH_FIELD) != public_json_ld[CONTENT_HASH_FIELD]:
+            await self._add(ReplaceOne({self.key_name: identifier}, public_json_ld, upsert=True))
+            return True
+        if stored.get(LANDING_PAGE_FIELD) != public_json_ld.get(LANDING_PAGE_FIELD):
+            # same content behind new validators, keep them so the next refresh can be answered with a 304
+            validators = {LANDING_PAGE_FIELD: public_json_ld.get(LANDING_PAGE_FIELD)}
+            await self._add(UpdateOne({self.key_name: identifier}, {"$set": validators}))
+        return False
+
+    async def delete(self, identifier: str) -> bool:
+        if self.fingerprints is not None and identifier not in self.fingerprints:
+            return False
+        await self._add(DeleteOne({self.key_name: identifier, "legacy": False}))
+        return True
+
+    async def _add(self, operation):
+        self.operations.append(operation)
+        if len(self.operations) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        operations, self.operations = self.operations, []
+        if not operations:
+            return
         try:
-            public_json_ld = await retrieve_submission_json_ld(submission.dict())
-            rec_key_name = "repository_identifier"
-            if public_json_ld:
-                # update or create
-                await db["discovery"].find_one_and_replace(
-                    {rec_key_name: public_json_ld[rec_key_name]}, public_json_ld, upsert=True
-                )
-            else:
-                # remove
-                await db["discovery"].delete_one({rec_key_name: submission.identifier, "legacy": False})
-        except Exception as exp:
-            logger.exception(f"Failed to collect submission {submission.url}\n Error: {str(exp)}")
+            await self.collection.bulk_write(operations, ordered=False)
+            self.written += len(operations)
+        except BulkWriteError as exp:
+            # unordered, so every operation but the failed ones was applied
+            errors = exp.details.get("writeErrors", [])
+            self.written += len(operations) - len(errors)
+            self.failed += len(errors)
+            for error in errors:
+                operation = operations[error['index']]
+                logger.error(f"Failed to write discovery record {operation}\n Error: {error['errmsg']}")
+
+
+async def refresh_submission(writer: DiscoveryWriter, submission) -> str:
+    """
+    Queues the update, creation or removal of the discovery record of a submission, returns what was done.
+    """
+    try:
+        public_json_ld = await retrieve_submission_json_ld(submission.dict(), writer.validators(submission.identifier))
+    except NotModified:
+        return "not_modified"
+    if public_json_ld:
+        # update or create
+        return "upserted" if await writer.replace(public_json_ld) else "unchanged"
+    # remove
+    return "removed" if await writer.delete(submission.identifier) else "unchanged"
+
+
+def submission_host(submission) -> str:
+    return urlparse(submission.url or "").netloc or str(submission.repo_type)
+
+
+async def refresh_submissions(submissions, refresh, concurrency: int, host_concurrency: int) -> Counter:
+    """
+    Runs refresh on each submission with a pool of concurrency workers, at most host_concurrency of them fetching from
+    the same repository host.  A failed submission is logged and counted without stopping the others.
+    """
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    host_limits = defaultdict(lambda: asyncio.Semaphore(host_concurrency))
+    outcomes = Counter()
+
+    async def worker():
+        while True:
+            submission = await queue.get()
+            try:
+                async with host_limits[submission_host(submission)]:
+                    outcomes[await refresh(submission)] += 1
+            except Exception as exp:
+                outcomes["failed"] += 1
+                logger.exception(f"Failed to collect submission {submission.url}\n Error: {str(exp)}")
+            finally:
+                queue.task_done()
+
+    start = time.monotonic()
+    workers = [asyncio.create_task(worker()) for _ in range(max(concurrency, 1))]
+    try:
+        async for submission in submissions:
+            await queue.put(submission)
+        await queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    elapsed = time.monotonic() - start
+    total = sum(outcomes.values())
+    logger.info(
+        f"Refreshed {total} submissions in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f}/s) "
+        f"with {concurrency} workers: {dict(outcomes)}"
+    )
+    return outcomes
+
+
+async def reconcile_discovery(db):
+    """
+    Brings the discovery record of every submission up to date and removes the records without a submission.
+    """
+    await init_beanie(database=db, document_models=[Submission])
+
+    await sweep_orphans(Submission.get_motor_collection(), db["discovery"])
+
+    settings = get_settings()
+    fingerprints = await discovery_fingerprints(db["discovery"])
+    writer = DiscoveryWriter(db["discovery"], settings.daily_write_batch_size, fingerprints)
+    landing_page_stats.clear()
+
+    async def refresh(submission):
+        return await refresh_submission(writer, submission)
+
+    outcomes = await refresh_submissions(
+        Submission.find_all(), refresh, settings.daily_concurrency, settings.daily_host_concurrency
+    )
+    await writer.flush()
+    changed = outcomes["upserted"] + outcomes["removed"]
+    logger.info(
+        f"{changed} of {sum(outcomes.values())} discovery records changed, "
+        f"wrote {writer.written} of them, {writer.failed} writes failed"
+    )
+    logger.info(f"Landing pages not modified by repository: {landing_page_stats.not_modified_ratios()}")
+
+
+@app.task(daily)
+async def do_daily():
+    db = motor.motor_asyncio.AsyncIOMotorClient(get_settings().mongo_url)[get_settings().mongo_database]
+    await reconcile_discovery(db)
 
 
 if __name__ == "__main__":
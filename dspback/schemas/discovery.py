@@ -90,6 +90,12 @@ class PathEnum(str, Enum):
         return [e.value for e in self]
 
 
+class CountStrategy(str, Enum):
+    exact = "exact"
+    approximate = "approximate"
+    deferred = "deferred"
+
+
 class Highlight(BaseModel):
     score: float
     path: PathEnum
@@ -1,96 +1,631 @@
 import asyncio
 import logging
 import re
+import string
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
 
 import motor
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import BulkWriteError, OperationFailure
 
 from dspback.config import get_settings
-from dspback.scheduler import retrieve_submission_json_ld
+from dspback.scheduler import reconcile_discovery, retrieve_submission_json_ld, sweep_orphans
+from dspback.utils.cache import search_cache
+from dspback.utils.jsonld.clusters import cluster_index
+from dspback.utils.jsonld.fingerprint import LANDING_PAGE_FIELD
+from dspback.utils.prefix_index import creator_index, typeahead_index
 
 logger = logging.getLogger()
 
+RESUME_TOKENS_COLLECTION = "resume_tokens"
+# change events a trigger gave up on, kept for inspection and replay
+DEAD_LETTERS_COLLECTION = "trigger_dead_letters"
+# InvalidResumeToken, ChangeStreamFatalError (reported by older servers) and ChangeStreamHistoryLost
+HISTORY_LOST_CODES = {260, 280, 286}
+# the daily refresh only $sets the landing page validators of unchanged records, those updates change nothing that is
+# derived from a discovery record and are left out of its change stream
+DISCOVERY_WATCH_PIPELINE = [
+    {
+        "$match": {
+            "$or": [
+                {"operationType": {"$ne": "update"}},
+                {"updateDescription.removedFields.0": {"$exists": True}},
+                {
+                    "$expr": {
+                        "$gt": [
+                            {
+                                "$size": {
+                                    "$filter": {
+                                        "input": {"$objectToArray": "$updateDescription.updatedFields"},
+                                        "as": "field",
+                                        "cond": {"$ne": ["$$field.k", LANDING_PAGE_FIELD]},
+                                    }
+                                }
+                            },
+                            0,
+                        ]
+                    }
+                },
+            ]
+        }
+    }
+]
+
+
+URL = re.compile(r'https?://\S+')
+# single characters except "a"
+SINGLE_CHARACTER = re.compile(r"\b[b-zA-Z]\b")
+
+
+# replace parentheses and forward slashes with a space, the other characters not kept are deleted
+SANITIZE_TABLE = bytes.maketrans(b"()/", b"   ")
+SANITIZE_DELETE = bytes(set(range(128)) - set((string.ascii_letters + string.digits + ",-_ ()/").encode()))
+
 
 def sanitize(text):
     # remove urls form text
-    text = re.sub(r'https?://\S+', '', text)
-    # remove all single characters except "a"
-    text = re.sub(r"\b[a-zA-Z](?<!a)\b", "", text)
-    # replace parentheses and forward slash with space
-    text = re.sub('[()/]', ' ', text)
-    # remove double dashes
-    text = re.sub('--', '', text)
-    # remove special characters
-    text = re.sub('[^a-zA-Z0-9,\-_ ]', '', text)
-    # remove leading/trailing hyphens
-    words = text.split(' ')
-    for i in range(len(words)):
-        words[i] = words[i].strip("-")
-    text = " ".join(words)
-    # remove extra spaces
-    text = " ".join(text.split())
-    return text
-
-
-async def watch_discovery():
-    db = motor.motor_asyncio.AsyncIOMotorClient(get_settings().mongo_url)[get_settings().mongo_database]
-    async with db["discovery"].watch(full_document="updateLookup") as stream:
-        async for change in stream:
-            logger.debug(f"processing discovery watch for document: {change}")
-            if change["operationType"] != "delete":
-                document = change["fullDocument"]
-                sanitized = {
-                    '_id': document['_id'],
-                    'name': sanitize(document['name']),
-                    'description': sanitize(document['description']),
-                    'keywords': [sanitize(keyword) for keyword in document['keywords']],
-                }
-                await db["typeahead"].find_one_and_replace({"_id": sanitized["_id"]}, sanitized, upsert=True)
-                logger.debug(f"Updating {change['documentKey']['_id']}")
-            else:
-                await db["typeahead"].delete_one({"_id": change["documentKey"]["_id"]})
-                logger.debug(f"Deleting {change['documentKey']['_id']}")
+    if "http" in text:
+        text = URL.sub('', text)
+    # remove all single characters except "a", word boundaries still count the characters removed below
+    text = SINGLE_CHARACTER.sub('', text)
+    # remove double dashes, before the special characters between dashes are removed
+    text = text.replace('--', '')
+    # replace parentheses and forward slash with space and remove special characters in one pass
+    text = text.encode("ascii", "ignore").translate(SANITIZE_TABLE, SANITIZE_DELETE).decode()
+    # remove leading/trailing hyphens and extra spaces
+    if "-" not in text:
+        return " ".join(text.split())
+    return " ".join(word for word in (word.strip("-") for word in text.split()) if word)
 
 
-async def watch_discovery_with_retry():
-    while True:
+class BatchStats:
+    """
+    Sizes and lag of the change event batches a trigger has processed.  The lag of a batch is the time between the
+    oldest change in it and its flush.
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.events = 0
+        self.writes = 0
+        self.failed = 0
+        self.last_batch_size = 0
+        self.last_lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+
+    def record(self, events: int, writes: int, lag_seconds: float):
+        self.batches += 1
+        self.events += events
+        self.writes += writes
+        self.last_batch_size = events
+        self.last_lag_seconds = lag_seconds
+        self.max_lag_seconds = max(self.max_lag_seconds, lag_seconds)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "events": self.events,
+            "writes": self.writes,
+            "failed": self.failed,
+            "mean_batch_size": self.events / self.batches if self.batches else 0.0,
+            "last_batch_size": self.last_batch_size,
+            "last_lag_seconds": self.last_lag_seconds,
+            "max_lag_seconds": self.max_lag_seconds,
+        }
+
+
+discovery_batch_stats = BatchStats()
+
+
+class LatencyStats:
+    """
+    Time from a change to the collection to the end of its processing, over the change events a trigger processed,
+    and the number of change events it gave up on.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.last_seconds = 0.0
+        self.max_seconds = 0.0
+        self.failed = 0
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.count if self.count else 0.0
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total_seconds += seconds
+        self.last_seconds = seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "failed": self.failed,
+            "mean_seconds": self.mean_seconds,
+            "last_seconds": self.last_seconds,
+            "max_seconds": self.max_seconds,
+        }
+
+
+submission_latency = LatencyStats()
+
+
+async def read_changes(stream, queue: asyncio.Queue):
+    """Moves the change events of the stream to the queue, blocks the stream while the queue is full"""
+    async for change in stream:
+        await queue.put(change)
+
+
+async def next_batch(queue: asyncio.Queue, max_size: int, window: float) -> list:
+    """
+    Waits for the next change event, then collects the events that arrive within window seconds, up to max_size.
+    """
+    batch = [await queue.get()]
+    deadline = time.monotonic() + window
+    while len(batch) < max_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+
+def coalesce(changes: list) -> list:
+    """Keeps only the latest change event of each document, in the order of those latest events"""
+    latest = {}
+    for change in changes:
+        _id = change["documentKey"]["_id"]
+        latest.pop(_id, None)
+        latest[_id] = change
+    return list(latest.values())
+
+
+def change_lag_seconds(change) -> float:
+    cluster_time = change.get("clusterTime")
+    if cluster_time is None:
+        return 0.0
+    return max(time.time() - cluster_time.time, 0.0)
+
+
+def sanitize_discovery(document: dict) -> dict:
+    return {
+        '_id': document['_id'],
+        'name': sanitize(document.get('name') or ''),
+        'description': sanitize(document.get('description') or ''),
+        'keywords': [sanitize(keyword) for keyword in document.get('keywords') or []],
+    }
+
+
+def discovery_operation(change):
+    """The typeahead write of a discovery change, the in-memory indexes are updated along with it"""
+    _id = change["documentKey"]["_id"]
+    if change["operationType"] == "delete":
+        typeahead_index.remove(_id)
+        creator_index.remove(_id)
+        cluster_index.remove(_id)
+        logger.debug(f"Deleting {_id}")
+        return DeleteOne({"_id": _id})
+    document = change["fullDocument"]
+    if document is None:
+        # the document was deleted after this change, its delete event follows
+        return None
+    sanitized = sanitize_discovery(document)
+    typeahead_index.update(sanitized)
+    creator_index.update(document)
+    cluster_index.update(document)
+    logger.debug(f"Updating {_id}")
+    return ReplaceOne({"_id": _id}, sanitized, upsert=True)
+
+
+async def apply_discovery_changes(db, changes: list, dead_letter=None) -> int:
+    """
+    Writes the typeahead documents of a batch of discovery changes with one unordered bulk_write and updates the
+    in-memory indexes, returns the number of writes.  A change that cannot be applied is logged and handed to
+    dead_letter(change, error), the rest of the batch is still written.
+    """
+    failed = []
+    operations = []
+    applied = []
+    for change in coalesce(changes):
         try:
-            await watch_discovery()
+            operation = discovery_operation(change)
         except Exception as exp:
-            logger.exception(f"Discovery Watch Task failed.\n Error:{str(exp)}\n Restarting the task after 1 second")
-            await asyncio.sleep(1)
+            logger.exception(f"Failed to apply the discovery change of {change['documentKey']['_id']}")
+            failed.append((change, exp))
+            continue
+        if operation is not None:
+            operations.append(operation)
+            applied.append(change)
+    writes = len(operations)
+    if operations:
+        try:
+            await db["typeahead"].bulk_write(operations, ordered=False)
+        except BulkWriteError as exp:
+            # unordered, so every operation but the failed ones was applied
+            errors = exp.details.get("writeErrors", [])
+            writes -= len(errors)
+            for error in errors:
+                operation = operations[error['index']]
+                logger.error(f"Failed to write typeahead document {operation}\n Error: {error['errmsg']}")
+                failed.append((applied[error['index']], exp))
+    if dead_letter is not None:
+        for change, error in failed:
+            await dead_letter(change, error)
+    return writes
 
 
-async def watch_submissions():
-    logger.info(f"Starting watching Submissions")
-    db = motor.motor_asyncio.AsyncIOMotorClient(get_settings().mongo_url)[get_settings().mongo_database]
-    async with db["Submission"].watch(
-        full_document="updateLookup", full_document_before_change="whenAvailable"
-    ) as stream:
+class ResumeTokens:
+    """
+    The resume token of the last change event processed from each change stream, stored in a MongoDB collection so a
+    restarted trigger continues where it stopped.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def load(self, stream: str):
+        document = await self.collection.find_one({"_id": stream})
+        return document["token"] if document else None
+
+    async def save(self, stream: str, token):
+        if token is None:
+            return
+        document = {"_id": stream, "token": token, "saved_at": datetime.utcnow()}
+        await self.collection.replace_one({"_id": stream}, document, upsert=True)
+
+
+async def open_change_stream(db, name: str, tokens: ResumeTokens, reconcile, **kwargs):
+    """
+    Opens the change stream of a collection after the stored resume token.  When the oplog no longer reaches back to
+    that token, a new change stream is opened and reconcile(db) brings everything derived from the collection up to
+    date, the changes made while it runs are delivered by the new stream.  Without a stored token (first start) the
+    change stream starts from now.  The token of a new change stream is saved as soon as it is open, or reconciled,
+    so a restart before its first change resumes from there.
+    """
+    token = await tokens.load(name)
+    if token is not None:
+        try:
+            # entering the change stream runs its aggregate, so an unusable token fails here
+            return await db[name].watch(resume_after=token, **kwargs).__aenter__()
+        except OperationFailure as exp:
+            if exp.code not in HISTORY_LOST_CODES:
+                raise
+            logger.warning(f"Cannot resume the {name} change stream, reconciling in full.\n Error:{str(exp)}")
+    stream = await db[name].watch(**kwargs).__aenter__()
+    if token is not None:
+        # the lost token stays saved until the reconcile is done, a restart before then reconciles again
+        try:
+            await reconcile(db)
+        except BaseException:
+            await stream.close()
+            raise
+        logger.info(f"Reconciled {name} after its change stream history was lost")
+    await tokens.save(name, stream.resume_token)
+    return stream
+
+
+async def reconcile_typeahead(db):
+    """
+    Rewrites the typeahead collection and the in-memory indexes from every discovery record and removes the typeahead
+    documents without one.
+    """
+    batch_size = get_settings().discovery_trigger_batch_size
+    identifiers = set()
+    changes = []
+    async for document in db["discovery"].find({}):
+        identifiers.add(document["_id"])
+        changes.append({"operationType": "replace", "documentKey": {"_id": document["_id"]}, "fullDocument": document})
+        if len(changes) >= batch_size:
+            await apply_discovery_changes(db, changes)
+            changes = []
+    orphans = {document["_id"] async for document in db["typeahead"].find({}, {"_id": 1})} - identifiers
+    changes.extend({"operationType": "delete", "documentKey": {"_id": _id}} for _id in orphans)
+    for start in range(0, len(changes), batch_size):
+        await apply_discovery_changes(db, changes[start : start + batch_size])
+    await search_cache.clear()
+
+
+class Watermark:
+    """
+    Change events handed to the workers in stream order.  Events finish out of order, the stream can only be resumed
+    after the last event before the first unfinished one.
+    """
+
+    def __init__(self):
+        self.next_sequence = 0
+        self.pending = OrderedDict()
+        self.token = None
+
+    def add(self, token) -> int:
+        sequence = self.next_sequence
+        self.next_sequence += 1
+        self.pending[sequence] = [token, False]
+        return sequence
+
+    def done(self, sequence: int):
+        self.pending[sequence][1] = True
+        while self.pending:
+            first = next(iter(self.pending))
+            token, finished = self.pending[first]
+            if not finished:
+                break
+            del self.pending[first]
+            self.token = token
+
+    def take(self):
+        """The token to resume after, if it advanced since the last take"""
+        token, self.token = self.token, None
+        return token
+
+
+async def process_changes(
+    stream,
+    process,
+    key,
+    workers: int,
+    queue_size: int,
+    acknowledge,
+    window: float = 0,
+    attempts: int = 1,
+    dead_letter=None,
+):
+    """
+    Processes the change events of the stream with a pool of workers.  Events with the same key always go to the same
+    worker, so they are processed in stream order, and reading the stream waits while that worker's queue is full.
+    With a window, an event is processed window seconds after it was read and only if no later event with the same key
+    was read by then, so a burst of changes to one document is processed once.  acknowledge(token) is called with the
+    resume token before which every event has been processed.  An event that fails attempts times in a row is handed
+    to dead_letter(change, error) and counts as processed, so it does not hold back the stream.  An event without a key
+    may concern any key, it is processed on its own once every event before it is, and the events after it wait for
+    it.  An error of the stream is raised.
+    """
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in range(workers)]
+    watermark = Watermark()
+    acknowledging = asyncio.Lock()
+    latest = {}
+
+    async def read():
         async for change in stream:
-            logger.debug(f"processing submission watch for document: {change}")
-            if change["operationType"] != "delete":
-                document = change["fullDocument"]
-                public_json_ld = await retrieve_submission_json_ld(document)
-
-                if public_json_ld:
-                    logger.debug(f"Found public jsonld, updating the discovery record for {document['identifier']}")
-                    await db["discovery"].find_one_and_replace(
-                        {"repository_identifier": public_json_ld["repository_identifier"]}, public_json_ld, upsert=True
-                    )
-                else:
-                    logger.debug(f"No public jsonld found, deleting the discovery record for {document['identifier']}")
-                    result = await db["discovery"].delete_one({"repository_identifier": document["identifier"]})
-                    logger.warning(f"delete count {result.deleted_count}")
+            sequence = watermark.add(change["_id"])
+            change_key = key(change)
+            if change_key is None:
+                # the serial lane, after every queued event and before reading the next
+                await asyncio.gather(*[queue.join() for queue in queues])
+                await attempt(change)
+                await finish(sequence)
+                continue
+            if window:
+                latest[change_key] = sequence
+            due = time.monotonic() + window
+            # hash() of a str differs between processes, crc32 keeps the worker of a key the same across restarts
+            await queues[zlib.crc32(str(change_key).encode()) % workers].put((sequence, change_key, change, due))
+
+    async def attempt(change):
+        for attempted in range(1, attempts + 1):
+            try:
+                await process(change)
+                return
+            except Exception as exp:
+                if attempted < attempts:
+                    logger.warning(f"Retrying change {change['_id']} after attempt {attempted} failed: {str(exp)}")
+                    continue
+                logger.exception(f"Skipping change {change['_id']} after {attempts} failed attempts")
+                if dead_letter is not None:
+                    await dead_letter(change, exp)
+
+    async def finish(sequence: int):
+        watermark.done(sequence)
+        async with acknowledging:
+            token = watermark.take()
+            if token is not None:
+                await acknowledge(token)
+
+    async def work(queue: asyncio.Queue):
+        while True:
+            sequence, change_key, change, due = await queue.get()
+            # events are queued in the order they are due, so waiting here delays the events behind by no more
+            await asyncio.sleep(max(due - time.monotonic(), 0))
+            if latest.get(change_key, sequence) == sequence:
+                await attempt(change)
+                if latest.get(change_key) == sequence:
+                    del latest[change_key]
             else:
-                document = change["fullDocumentBeforeChange"]
-                logger.debug(f"Deleting the discovery record for {document['identifier']}")
-                await db["discovery"].delete_one({"repository_identifier": document["identifier"]})
+                logger.debug(f"Skipping change {sequence} of {change_key}, a later change replaces it")
+            await finish(sequence)
+            queue.task_done()
 
+    reader = asyncio.create_task(read())
+    worker_tasks = [asyncio.create_task(work(queue)) for queue in queues]
+    try:
+        done, _ = await asyncio.wait([reader, *worker_tasks], return_when=asyncio.FIRST_COMPLETED)
+        if reader in done:
+            reader.result()
+            # the stream ended, finish the queued events
+            drained = asyncio.ensure_future(asyncio.gather(*[queue.join() for queue in queues]))
+            done, _ = await asyncio.wait([drained, *worker_tasks], return_when=asyncio.FIRST_COMPLETED)
+            drained.cancel()
+        for task in done:
+            task.result()
+    finally:
+        for task in [reader, *worker_tasks]:
+            task.cancel()
 
-async def watch_submissions_with_retry():
+
+def discovery_indexes():
+    """The enabled in-memory indexes with the collection each is loaded from"""
+    settings = get_settings()
+    indexes = [
+        (settings.typeahead_index_enabled, typeahead_index, "typeahead"),
+        (settings.creator_index_enabled, creator_index, "discovery"),
+        (settings.cluster_index_enabled, cluster_index, "discovery"),
+    ]
+    return [(index, collection) for enabled, index, collection in indexes if enabled]
+
+
+async def watch_discovery(db):
+    """
+    Applies the discovery changes to the typeahead collection and the in-memory indexes.  The indexes are loaded once
+    the change stream is open and are only ready while it is read, the discovery endpoints query the database when the
+    trigger is not running.  Changes that cannot be applied are kept in the dead letter collection.
+    """
+    settings = get_settings()
+    tokens = ResumeTokens(db[RESUME_TOKENS_COLLECTION])
+    stream = await open_change_stream(
+        db, "discovery", tokens, reconcile_typeahead, pipeline=DISCOVERY_WATCH_PIPELINE, full_document="updateLookup"
+    )
+    indexes = discovery_indexes()
+
+    async def dead_letter(change, error):
+        discovery_batch_stats.failed += 1
+        document = {"stream": "discovery", "change": change, "error": repr(error), "failed_at": datetime.utcnow()}
+        await db[DEAD_LETTERS_COLLECTION].insert_one(document)
+
+    async with stream:
+        # changes made while loading are delivered by the stream and applied again
+        await asyncio.gather(*[index.load(db[collection]) for index, collection in indexes])
+        queue = asyncio.Queue(maxsize=settings.discovery_trigger_batch_size * 2)
+        reader = asyncio.create_task(read_changes(stream, queue))
+        try:
+            while True:
+                batch_task = asyncio.ensure_future(
+                    next_batch(queue, settings.discovery_trigger_batch_size, settings.discovery_trigger_batch_seconds)
+                )
+                await asyncio.wait([batch_task, reader], return_when=asyncio.FIRST_COMPLETED)
+                if not batch_task.done():
+                    batch_task.cancel()
+                    # the stream ended or failed, its error is raised for the retry
+                    reader.result()
+                    return
+                changes = batch_task.result()
+                logger.debug(f"processing {len(changes)} discovery changes")
+                # any change to the discovery collection can change search results
+                await search_cache.clear()
+                writes = await apply_discovery_changes(db, changes, dead_letter)
+                lag = max(change_lag_seconds(change) for change in changes)
+                await tokens.save("discovery", changes[-1]["_id"])
+                discovery_batch_stats.record(len(changes), writes, lag)
+                logger.info(f"Applied {len(changes)} discovery changes with {writes} typeahead writes, lag {lag:.1f}s")
+        finally:
+            reader.cancel()
+            for index, _ in indexes:
+                index.ready = False
+
+
+def trigger_database():
+    settings = get_settings()
+    return motor.motor_asyncio.AsyncIOMotorClient(settings.mongo_url)[settings.mongo_database]
+
+
+async def watch_with_retry(name: str, watch, db):
+    """
+    Runs watch(db) again whenever it ends.  After a failure it waits trigger_retry_seconds, doubled after each failure
+    in a row up to trigger_retry_max_seconds, and a watch that ran for that long before failing starts over.  Every
+    restart shares the database, and with it the client and its connection pool.
+    """
+    settings = get_settings()
+    delay = settings.trigger_retry_seconds
     while True:
+        started = time.monotonic()
         try:
-            await watch_submissions()
+            await watch(db)
+            delay = settings.trigger_retry_seconds
         except Exception as exp:
-            logger.exception(f"Submission Watch Task failed.\n Error:{str(exp)}\n Restarting the task after 1 second")
-            await asyncio.sleep(1)
+            if time.monotonic() - started >= settings.trigger_retry_max_seconds:
+                delay = settings.trigger_retry_seconds
+            logger.exception(
+                f"{name} Watch Task failed.\n Error:{str(exp)}\n Restarting the task after {delay} seconds"
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, settings.trigger_retry_max_seconds)
+
+
+async def watch_discovery_with_retry():
+    await watch_with_retry("Discovery", watch_discovery, trigger_database())
+
+
+def submission_key(change):
+    """
+    Events are ordered per submission identifier, the key of their discovery record.  A delete without the document
+    before it has no identifier, it goes through the serial lane.
+    """
+    document = change.get("fullDocument") or change.get("fullDocumentBeforeChange") or {}
+    return document.get("identifier")
+
+
+async def process_submission_change(db, change):
+    logger.debug(f"processing submission watch for document: {change}")
+    if change["operationType"] != "delete":
+        document = change["fullDocument"]
+        public_json_ld = await retrieve_submission_json_ld(document)
+
+        if public_json_ld:
+            logger.debug(f"Found public jsonld, updating the discovery record for {document['identifier']}")
+            await db["discovery"].find_one_and_replace(
+                {"repository_identifier": public_json_ld["repository_identifier"]}, public_json_ld, upsert=True
+            )
+        else:
+            logger.debug(f"No public jsonld found, deleting the discovery record for {document['identifier']}")
+            result = await db["discovery"].delete_one({"repository_identifier": document["identifier"]})
+            logger.warning(f"delete count {result.deleted_count}")
+    elif change.get("fullDocumentBeforeChange"):
+        document = change["fullDocumentBeforeChange"]
+        logger.debug(f"Deleting the discovery record for {document['identifier']}")
+        await db["discovery"].delete_one({"repository_identifier": document["identifier"]})
+    else:
+        # the document before the delete is no longer available, remove whichever record lost its submission
+        logger.debug(f"No pre-image for the delete of {change['documentKey']['_id']}, sweeping orphan records")
+        await sweep_orphans(db["Submission"], db["discovery"])
+    latency = change_lag_seconds(change)
+    submission_latency.record(latency)
+    logger.debug(f"Processed the submission change {latency:.1f}s after it was made")
+
+
+async def watch_submissions(db):
+    logger.info(f"Starting watching Submissions")
+    settings = get_settings()
+    tokens = ResumeTokens(db[RESUME_TOKENS_COLLECTION])
+    stream = await open_change_stream(
+        db,
+        "Submission",
+        tokens,
+        reconcile_discovery,
+        full_document="updateLookup",
+        full_document_before_change="whenAvailable",
+    )
+
+    async def process(change):
+        await process_submission_change(db, change)
+
+    async def acknowledge(token):
+        await tokens.save("Submission", token)
+
+    async def dead_letter(change, error):
+        submission_latency.failed += 1
+        document = {"stream": "Submission", "change": change, "error": repr(error), "failed_at": datetime.utcnow()}
+        await db[DEAD_LETTERS_COLLECTION].insert_one(document)
+
+    async with stream:
+        await process_changes(
+            stream,
+            process,
+            submission_key,
+            settings.submission_trigger_workers,
+            settings.submission_trigger_queue_size,
+            acknowledge,
+            settings.submission_trigger_debounce_seconds,
+            settings.submission_trigger_attempts,
+            dead_letter,
+        )
+
+
+async def watch_submissions_with_retry():
+    await watch_with_retry("Submission", watch_submissions, trigger_database())
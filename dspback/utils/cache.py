@@ -0,0 +1,148 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+
+from dspback.config import get_settings
+
+
+class TTLCache:
+    """
+    In-process LRU cache.  Entries are evicted once max_size is reached (least recently used first) or when they
+    are older than ttl seconds.
+    """
+
+    def __init__(self, max_size: int = 512, ttl: float = 300, timer=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._timer = timer
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self._timer():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value):
+        self._entries[key] = (self._timer() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def clear(self):
+        self._entries.clear()
+
+
+class MongoCache:
+    """
+    Cache shared between processes, stored in a MongoDB collection.  Expired entries are ignored on read and removed
+    by the TTL index on expires_at.
+    """
+
+    def __init__(self, collection, ttl: float = 300):
+        self.collection = collection
+        self.ttl = ttl
+
+    async def create_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def get(self, key):
+        entry = await self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        if entry is None:
+            return None
+        return entry["value"]
+
+    async def set(self, key, value):
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl)
+        await self.collection.replace_one({"_id": key}, {"value": value, "expires_at": expires_at}, upsert=True)
+
+    async def clear(self):
+        await self.collection.delete_many({})
+
+
+class SearchCache:
+    """
+    Caches discovery search results in a local TTLCache, backed by an optional shared cache.  Values are stored in
+    their json encoded form so they can be shared and are never mutated after being cached.
+    """
+
+    def __init__(self, local: TTLCache, shared=None):
+        self.local = local
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        value = await self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.shared is not None:
+            value = await self.shared.get(key)
+            if value is not None:
+                self.shared_hits += 1
+                await self.local.set(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key, value):
+        value = jsonable_encoder(value)
+        await self.local.set(key, value)
+        if self.shared is not None:
+            await self.shared.set(key, value)
+        return value
+
+    async def clear(self):
+        await self.local.clear()
+        if self.shared is not None:
+            await self.shared.clear()
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            "size": len(self.local),
+            "max_size": self.local.max_size,
+            "ttl": self.local.ttl,
+            "shared": self.shared is not None,
+        }
+
+
+def cache_key(namespace: str, params: dict) -> str:
+    """
+    Builds a key from the query parameters that is independent of parameter order, cluster order and whitespace in the
+    search term.  Unset parameters are ignored.
+    """
+    canonical = {}
+    for name, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = " ".join(value.split())
+        elif isinstance(value, (list, tuple, set)):
+            value = sorted(value)
+        canonical[name] = value
+    digest = hashlib.sha1(json.dumps(canonical, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{namespace}:{digest}"
+
+
+search_cache = SearchCache(
+    TTLCache(max_size=get_settings().search_cache_max_size, ttl=get_settings().search_cache_ttl_seconds)
+)
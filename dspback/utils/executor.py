@@ -0,0 +1,44 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from dspback.config import get_settings
+
+
+class ProcessPool:
+    """
+    Runs cpu bound functions in worker processes so they do not hold up the event loop serving the api.  The pool is
+    started on first use; with a size of 0 the functions run in the calling thread.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._executor = None
+
+    def _get(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawned rather than forked, the parent process runs an event loop and database client threads
+            self._executor = ProcessPoolExecutor(self.size, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def run(self, function, *args, **kwargs):
+        if self.size <= 0:
+            return function(*args, **kwargs)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get(), functools.partial(function, *args, **kwargs)
+            )
+        except BrokenProcessPool:
+            # a worker died, start a new pool for the next call
+            self.shutdown()
+            raise
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+parse_pool = ProcessPool(get_settings().parse_pool_size)
@@ -0,0 +1,168 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
+
+REPORT_FIELDS = [
+    'name',
+    'description',
+    'keywords',
+    'datePublished',
+    'dateCreated',
+    'provider',
+    'funding',
+    'clusters',
+    'url',
+    'legacy',
+]
+
+REPORT_SCHEMA = pyarrow.schema(
+    [
+        ('name', pyarrow.string()),
+        ('description', pyarrow.string()),
+        ('keywords', pyarrow.list_(pyarrow.string())),
+        ('datePublished', pyarrow.timestamp('ms')),
+        ('dateCreated', pyarrow.timestamp('ms')),
+        ('provider', pyarrow.string()),
+        ('funding', pyarrow.list_(pyarrow.string())),
+        ('clusters', pyarrow.list_(pyarrow.string())),
+        ('url', pyarrow.string()),
+        ('legacy', pyarrow.bool_()),
+    ]
+)
+
+BATCH_SIZE = 500
+
+
+def format_report_row(row: dict) -> dict:
+    if 'provider' in row:
+        row['provider'] = row['provider']['name']
+    if 'funding' in row:
+        funding_ids = []
+        for funding in row['funding']:
+            if 'identifier' in funding:
+                funding_ids.append(funding['identifier'])
+        row['funding'] = funding_ids
+    return row
+
+
+async def report_rows(collection, stages: list = None, fields: list = None, batch_size: int = BATCH_SIZE):
+    """
+    Iterates the discovery report rows matching the stages, only batch_size documents are held in memory at a time.
+    """
+    projection = {field: 1 for field in fields or REPORT_FIELDS}
+    projection['_id'] = 0
+    stages = (stages or []) + [{'$project': projection}]
+    async for row in collection.aggregate(stages, batchSize=batch_size):
+        yield format_report_row(row)
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+    return str(value)
+
+
+async def csv_chunks(rows, chunk_size: int = BATCH_SIZE):
+    """
+    Writes the report rows as csv, yielding the text every chunk_size rows.  The first column is the row number.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([""] + REPORT_FIELDS)
+    index = 0
+    async for row in rows:
+        writer.writerow([index] + [csv_value(row.get(field)) for field in REPORT_FIELDS])
+        index += 1
+        if index % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def ndjson_chunks(rows, chunk_size: int = BATCH_SIZE):
+    """
+    Writes one json document per line, yielding the text every chunk_size rows.
+    """
+    lines = []
+    async for row in rows:
+        lines.append(json.dumps(row, default=json_default) + "\n")
+        if len(lines) == chunk_size:
+            yield "".join(lines)
+            lines = []
+    yield "".join(lines)
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    A write only file for pyarrow writers that hands the written bytes back in chunks instead of keeping them.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def record_batch(rows: list, schema: pyarrow.Schema) -> pyarrow.RecordBatch:
+    return pyarrow.RecordBatch.from_pylist(rows, schema=schema)
+
+
+def report_schema(fields: list = None) -> pyarrow.Schema:
+    return pyarrow.schema([REPORT_SCHEMA.field(field) for field in fields or REPORT_FIELDS])
+
+
+async def _arrow_chunks(rows, schema, open_writer, chunk_size):
+    sink = ChunkSink()
+    writer = open_writer(sink, schema)
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) == chunk_size:
+            writer.write_batch(record_batch(batch, schema))
+            batch = []
+            yield sink.drain()
+    if batch:
+        writer.write_batch(record_batch(batch, schema))
+    writer.close()
+    yield sink.drain()
+
+
+def parquet_chunks(rows, fields: list = None, chunk_size: int = BATCH_SIZE):
+    """
+    Writes the report rows as parquet, one row group per chunk_size rows.
+    """
+    return _arrow_chunks(rows, report_schema(fields), pyarrow.parquet.ParquetWriter, chunk_size)
+
+
+def arrow_chunks(rows, fields: list = None, chunk_size: int = BATCH_SIZE):
+    """
+    Writes the report rows in the Arrow IPC streaming format, one record batch per chunk_size rows.
+    """
+    return _arrow_chunks(rows, report_schema(fields), pyarrow.ipc.new_stream, chunk_size)
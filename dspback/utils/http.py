@@ -0,0 +1,78 @@
+from urllib.parse import urlparse
+
+import aiohttp
+import httpx
+
+from dspback.config import get_settings, repository_config
+
+
+class SharedSession:
+    """
+    One aiohttp client session for the whole process, so connections and resolved host names are reused across
+    requests.  The session is created on first use, in the running event loop, and again after it is closed.
+    """
+
+    def __init__(self):
+        self._session = None
+
+    def get(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            settings = get_settings()
+            connector = aiohttp.TCPConnector(
+                ssl=False,
+                limit=settings.http_pool_size,
+                limit_per_host=settings.http_pool_size_per_host,
+                ttl_dns_cache=settings.http_dns_cache_seconds,
+                keepalive_timeout=settings.http_keepalive_seconds,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+http_session = SharedSession()
+
+
+def repository_base_url(repository_type) -> str:
+    create_url = urlparse(str(repository_config[repository_type]["create"]))
+    return f"{create_url.scheme}://{create_url.netloc}"
+
+
+class RepositoryClients:
+    """
+    One pooled httpx client per repository, so a slow repository only ties up its own connections.  Every call has
+    the configured timeout unless the call passes its own, and redirects are followed.
+    """
+
+    def __init__(self):
+        self._clients = {}
+
+    def get(self, repository_type) -> httpx.AsyncClient:
+        client = self._clients.get(repository_type)
+        if client is None or client.is_closed:
+            settings = get_settings()
+            client = httpx.AsyncClient(
+                base_url=repository_base_url(repository_type),
+                timeout=httpx.Timeout(settings.repository_timeout_seconds),
+                # as requests did, so moved repository urls keep working
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=settings.repository_pool_size,
+                    max_keepalive_connections=settings.repository_pool_size,
+                    keepalive_expiry=settings.http_keepalive_seconds,
+                ),
+            )
+            self._clients[repository_type] = client
+        return client
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+repository_clients = RepositoryClients()
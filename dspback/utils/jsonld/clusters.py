@@ -1,3 +1,9 @@
+import functools
+import logging
+from collections import Counter
+
+logger = logging.getLogger()
+
 cluster_by_id = {
     "2012073": "Bedrock Cluster",
     "2012264": "Bedrock Cluster",
@@ -91,3 +97,66 @@ legacy_clusters = [
 ]
 
 all_clusters = current_clusters + legacy_clusters
+
+
+def compare(c1: str, c2: str):
+    if c1.startswith("CZO"):
+        if c2.startswith("CZO"):
+            return c1 < c2
+        else:
+            return 1
+    if c2.startswith("CZO"):
+        return -1
+    return c1 < c2
+
+
+class ClusterIndex:
+    """
+    The clusters of the discovery records with the number of records in each cluster.  Loaded and kept current
+    by the discovery trigger, the sorted cluster list is only rebuilt when a cluster is added or removed.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.clusters_by_document = {}
+        self.sorted_clusters = []
+        self.ready = False
+
+    async def load(self, collection):
+        self.ready = False
+        self.counts.clear()
+        self.clusters_by_document.clear()
+        try:
+            async for document in collection.find({}, {"clusters": 1}):
+                self.update(document)
+        except Exception as exp:
+            logger.exception(f"Failed to load the cluster index.\n Error: {str(exp)}")
+            return
+        self.ready = True
+
+    def update(self, document: dict):
+        existing = set(self.counts)
+        self._remove(document["_id"])
+        _clusters = set(document.get("clusters") or [])
+        self.clusters_by_document[document["_id"]] = _clusters
+        self.counts.update(_clusters)
+        if set(self.counts) != existing:
+            self._sort()
+
+    def remove(self, _id):
+        existing = set(self.counts)
+        self._remove(_id)
+        if set(self.counts) != existing:
+            self._sort()
+
+    def _remove(self, _id):
+        for cluster in self.clusters_by_document.pop(_id, set()):
+            self.counts[cluster] -= 1
+            if self.counts[cluster] <= 0:
+                del self.counts[cluster]
+
+    def _sort(self):
+        self.sorted_clusters = sorted(self.counts, key=functools.cmp_to_key(compare))
+
+
+cluster_index = ClusterIndex()
@@ -0,0 +1,18 @@
+import hashlib
+import json
+
+CONTENT_HASH_FIELD = "content_hash"
+# the ETag and Last-Modified validators of the landing page a record was scraped from
+LANDING_PAGE_FIELD = "landing_page"
+# fields describing how a record was fetched rather than what it says
+IGNORED_FIELDS = ("_id", CONTENT_HASH_FIELD, LANDING_PAGE_FIELD)
+
+
+def content_hash(json_ld: dict) -> str:
+    """
+    A sha256 of the canonical json of a discovery record, ignoring the database id, the stored hash and the landing
+    page validators.
+    """
+    content = {key: value for key, value in json_ld.items() if key not in IGNORED_FIELDS}
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
@@ -1,36 +1,142 @@
 import html
 import json
+import re
+from collections import Counter, defaultdict
 
-import aiohttp
 from bs4 import BeautifulSoup
 
 from dspback.pydantic_schemas import RepositoryType
 from dspback.schemas.discovery import JSONLD
+from dspback.utils.executor import parse_pool
+from dspback.utils.http import http_session
+from dspback.utils.jsonld.fingerprint import LANDING_PAGE_FIELD
 from dspback.utils.jsonld.formatter import format_fields
 
+SCRIPT_START = re.compile(r"<script\b([^>]*)>", re.IGNORECASE)
+SCRIPT_END = re.compile(r"</script\s*>", re.IGNORECASE)
+ATTRIBUTE = re.compile(r"""([^\s=/>"']+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>"']+)))?""")
 
-def scrape_jsonld(resource_data, script_match):
+
+def script_attributes(attributes: str) -> dict:
+    return {
+        match.group(1).lower(): html.unescape(match.group(2) or match.group(3) or match.group(4) or "")
+        for match in ATTRIBUTE.finditer(attributes)
+    }
+
+
+def find_script(resource_data: str, script_match: dict):
+    """
+    Returns the text of the first script tag with the script_match attributes, scanning only the script tags of the
+    page and stopping at the first match instead of parsing the whole document.
+    """
+    for start in SCRIPT_START.finditer(resource_data):
+        attributes = script_attributes(start.group(1))
+        if all(attributes.get(name) == value for name, value in script_match.items()):
+            end = SCRIPT_END.search(resource_data, start.end())
+            if end is None:
+                return None
+            return resource_data[start.end() : end.start()]
+    return None
+
+
+def soup_find_script(resource_data: str, script_match: dict):
     resource_soup = BeautifulSoup(resource_data, "html.parser")
-    resource_json_ld = resource_soup.find("script", script_match)
+    script = resource_soup.find("script", script_match)
+    return script.text if script else None
+
+
+def scrape_jsonld(resource_data, script_match):
+    resource_json_ld = None
+    script = find_script(resource_data, script_match)
+    if script is not None:
+        try:
+            resource_json_ld = json.loads(html.unescape(script))
+        except json.JSONDecodeError:
+            pass
+    if resource_json_ld is None:
+        # a page the fast path could not read is parsed in full
+        script = soup_find_script(resource_data, script_match)
+        if script:
+            resource_json_ld = json.loads(html.unescape(script))
     if resource_json_ld:
-        resource_json_ld = json.loads(html.unescape(resource_json_ld.text))
         resource_json_ld = format_fields(resource_json_ld)
 
     return resource_json_ld
 
 
-async def fetch_landing_page(url):
-    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False)) as session:
-        async with session.get(url) as response:
-            if response.status != 200:
-                return None
-            return await response.text()
+class NotModified(Exception):
+    """The landing page has not changed since the validators were issued"""
 
 
-async def retrieve_discovery_jsonld(identifier, repository_type, url):
-    resource_data = await fetch_landing_page(url)
-    if not resource_data:
-        return None
+class LandingPageStats:
+    """
+    Counts the conditional landing page requests and the 304 responses by repository.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(Counter)
+
+    def record(self, repository, status: int):
+        self.counts[str(repository)]["conditional"] += 1
+        if status == 304:
+            self.counts[str(repository)]["not_modified"] += 1
+
+    def not_modified_ratios(self) -> dict:
+        return {
+            repository: counts["not_modified"] / counts["conditional"] for repository, counts in self.counts.items()
+        }
+
+    def stats(self):
+        return {
+            repository: {
+                "conditional": counts["conditional"],
+                "not_modified": counts["not_modified"],
+                "not_modified_ratio": counts["not_modified"] / counts["conditional"],
+            }
+            for repository, counts in self.counts.items()
+        }
+
+    def clear(self):
+        self.counts.clear()
+
+
+landing_page_stats = LandingPageStats()
+
+
+def conditional_headers(validators: dict) -> dict:
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+async def fetch_landing_page(url, validators: dict = None, repository_type=None):
+    """
+    Returns the landing page text and its validators.  When the validators of a previous fetch are given the request is
+    conditional and NotModified is raised for a 304.
+    """
+    headers = conditional_headers(validators) if validators else {}
+    async with http_session.get().get(url, headers=headers) as response:
+        if headers:
+            landing_page_stats.record(repository_type, response.status)
+        if response.status == 304:
+            raise NotModified(url)
+        if response.status != 200:
+            return None, None
+        new_validators = {
+            key: response.headers[header]
+            for key, header in (("etag", "ETag"), ("last_modified", "Last-Modified"))
+            if header in response.headers
+        }
+        return await response.text(), new_validators or None
+
+
+def parse_discovery_jsonld(resource_data, identifier, repository_type):
+    """
+    Scrapes, formats and validates the json-ld of a landing page, cpu bound so it is run in the parse pool.
+    """
     script_match = (
         {"id": "schemaorg"} if repository_type == RepositoryType.HYDROSHARE else {"type": "application/ld+json"}
     )
@@ -46,8 +152,17 @@ async def retrieve_discovery_jsonld(identifier, repository_type, url):
         parse_funding_jsonld(resource_json_ld)
 
     resource_json_ld["repository_identifier"] = identifier
-    jsonld = JSONLD(**resource_json_ld)
-    return jsonld.dict(by_alias=True, exclude_none=True)
+    return JSONLD(**resource_json_ld).dict(by_alias=True, exclude_none=True)
+
+
+async def retrieve_discovery_jsonld(identifier, repository_type, url, validators: dict = None):
+    resource_data, validators = await fetch_landing_page(url, validators, repository_type)
+    if not resource_data:
+        return None
+    jsonld = await parse_pool.run(parse_discovery_jsonld, resource_data, identifier, repository_type)
+    if jsonld and validators:
+        jsonld[LANDING_PAGE_FIELD] = validators
+    return jsonld
 
 
 def parse_funding_jsonld(resource_json_ld):
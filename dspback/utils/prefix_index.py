@@ -0,0 +1,292 @@
+import heapq
+import logging
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+from dspback.schemas.discovery import PathEnum
+
+logger = logging.getLogger()
+
+EXACT_MATCH_SCORE = 1.0
+FUZZY_MATCH_SCORE = 0.5
+
+
+def normalize(word: str) -> str:
+    return word.lower().strip(",")
+
+
+class PrefixIndex:
+    """
+    Maps keys to sets of items.  Keys are held in a sorted list so every key starting with a prefix is found with a
+    bisect, and keys within one edit of a prefix are found by looking up each single edit variant of the prefix.
+    """
+
+    def __init__(self, min_fuzzy_length: int = 3):
+        self.min_fuzzy_length = min_fuzzy_length
+        self._items = defaultdict(set)
+        self._keys = []
+        self._alphabet = set()
+        self._bulk = False
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key: str, item):
+        if not key:
+            return
+        if key not in self._items:
+            self._alphabet.update(key)
+            if not self._bulk:
+                insort(self._keys, key)
+        self._items[key].add(item)
+
+    def discard(self, key: str, item):
+        items = self._items.get(key)
+        if items is None:
+            return
+        items.discard(item)
+        if not items:
+            del self._items[key]
+            index = bisect_left(self._keys, key)
+            if index < len(self._keys) and self._keys[index] == key:
+                del self._keys[index]
+
+    def items(self, key: str):
+        return self._items.get(key, set())
+
+    def start_bulk(self):
+        """Defers sorting the keys until end_bulk, adding keys one at a time to the sorted list is quadratic"""
+        self._bulk = True
+
+    def end_bulk(self):
+        self._bulk = False
+        self._keys = sorted(self._items)
+
+    def clear(self):
+        self._items.clear()
+        self._keys = []
+        self._alphabet = set()
+
+    def keys_with_prefix(self, prefix: str):
+        start = bisect_left(self._keys, prefix)
+        end = bisect_left(self._keys, prefix + chr(0x10FFFF), start)
+        return self._keys[start:end]
+
+    def lookup(self, prefix: str, fuzzy: bool = True) -> dict:
+        """
+        Returns the keys that start with the prefix, or with a string one edit away from the prefix when fuzzy, mapped
+        to whether the match was exact.
+        """
+        matches = {key: True for key in self.keys_with_prefix(prefix)}
+        if fuzzy and len(prefix) >= self.min_fuzzy_length:
+            for variant in self._single_edits(prefix):
+                for key in self.keys_with_prefix(variant):
+                    matches.setdefault(key, False)
+        return matches
+
+    def _single_edits(self, prefix: str):
+        variants = set()
+        for i in range(len(prefix)):
+            variants.add(prefix[:i] + prefix[i + 1 :])
+            for char in self._alphabet:
+                variants.add(prefix[:i] + char + prefix[i + 1 :])
+                variants.add(prefix[:i] + char + prefix[i:])
+        variants.discard(prefix)
+        # a shorter variant matches too broadly to be a useful suggestion
+        return {variant for variant in variants if len(variant) >= self.min_fuzzy_length}
+
+
+class TypeaheadIndex:
+    """
+    In-memory replacement for the Atlas autocomplete search over the typeahead collection.  Loaded and kept current by
+    the discovery trigger, results are returned in the TypeAhead highlight shape.
+    """
+
+    paths = [PathEnum.name.value, PathEnum.description.value, PathEnum.keywords.value]
+
+    def __init__(self, description_window: int = 8, min_prefix_length: int = 2):
+        self.description_window = description_window
+        self.min_prefix_length = min_prefix_length
+        self.words = PrefixIndex()
+        self.documents = {}
+        self.ready = False
+
+    def __len__(self):
+        return len(self.documents)
+
+    async def load(self, collection):
+        self.ready = False
+        self.words.clear()
+        self.documents.clear()
+        self.words.start_bulk()
+        try:
+            async for document in collection.find({}, {path: 1 for path in self.paths}):
+                self.update(document)
+        except Exception as exp:
+            logger.exception(f"Failed to load the typeahead index, falling back to Atlas Search.\n Error: {str(exp)}")
+            return
+        finally:
+            self.words.end_bulk()
+        self.ready = True
+        logger.info(f"Loaded {len(self.documents)} typeahead documents with {len(self.words)} words")
+
+    def update(self, document: dict):
+        self.remove(document["_id"])
+        values = {
+            PathEnum.name.value: [document.get("name") or ""],
+            PathEnum.description.value: [document.get("description") or ""],
+            PathEnum.keywords.value: [keyword for keyword in document.get("keywords") or [] if keyword],
+        }
+        self.documents[document["_id"]] = values
+        for path, path_values in values.items():
+            for value in path_values:
+                for word in value.split():
+                    self.words.add(normalize(word), (document["_id"], path))
+
+    def remove(self, _id):
+        values = self.documents.pop(_id, None)
+        if values is None:
+            return
+        for path, path_values in values.items():
+            for value in path_values:
+                for word in value.split():
+                    self.words.discard(normalize(word), (_id, path))
+
+    def search(self, term: str, page_size: int = 30) -> list:
+        # matched words and their score by document and path
+        hits = defaultdict(lambda: defaultdict(dict))
+        for term_word in term.split():
+            term_word = normalize(term_word)
+            if len(term_word) < self.min_prefix_length:
+                continue
+            matches = self.words.lookup(term_word, fuzzy=False)
+            # fuzzy matches are only needed when the exact prefix matches cannot fill the page
+            if sum(len(self.words.items(word)) for word in matches) < page_size:
+                matches = self.words.lookup(term_word)
+            for word, exact in matches.items():
+                score = EXACT_MATCH_SCORE if exact else FUZZY_MATCH_SCORE
+                for _id, path in self.words.items(word):
+                    path_hits = hits[_id][path]
+                    path_hits[word] = max(score, path_hits.get(word, 0))
+
+        def document_score(_id):
+            return max(sum(words.values()) for words in hits[_id].values())
+
+        # only the highlights of the returned page are built
+        results = []
+        for _id in heapq.nlargest(page_size, hits, key=document_score):
+            highlights = []
+            for path, words in hits[_id].items():
+                highlights.extend(self._highlights(self.documents[_id][path], path, words))
+            highlights.sort(key=lambda highlight: highlight["score"], reverse=True)
+            results.append({"highlights": highlights})
+        return results
+
+    def _highlights(self, values: list, path: str, words: dict) -> list:
+        highlights = []
+        for value in values:
+            tokens = value.split()
+            hit_indexes = [i for i, token in enumerate(tokens) if normalize(token) in words]
+            if not hit_indexes:
+                continue
+            score = sum(words[word] for word in {normalize(tokens[i]) for i in hit_indexes})
+            if path == PathEnum.description.value:
+                start = max(hit_indexes[0] - self.description_window, 0)
+                tokens = tokens[start : hit_indexes[0] + self.description_window + 1]
+
+            texts = []
+            for i, token in enumerate(tokens):
+                pieces = [(token, "hit" if normalize(token) in words else "text")]
+                if i:
+                    pieces.insert(0, (" ", "text"))
+                for piece, piece_type in pieces:
+                    if piece_type == "text" and texts and texts[-1]["type"] == "text":
+                        texts[-1]["value"] += piece
+                    else:
+                        texts.append({"value": piece, "type": piece_type})
+            highlights.append({"score": score, "path": path, "texts": texts})
+        return highlights
+
+
+def normalize_name(word: str) -> str:
+    return "".join(char for char in word.lower() if char.isalnum())
+
+
+class CreatorIndex:
+    """
+    Distinct creator names of the discovery records with the number of records listing each name.  Loaded and kept
+    current by the discovery trigger, lookups scale with the number of distinct creators.
+    """
+
+    def __init__(self, min_prefix_length: int = 2):
+        self.min_prefix_length = min_prefix_length
+        self.words = PrefixIndex()
+        self.counts = Counter()
+        self.creators_by_document = {}
+        self.ready = False
+
+    def __len__(self):
+        return len(self.counts)
+
+    async def load(self, collection):
+        self.ready = False
+        self.words.clear()
+        self.counts.clear()
+        self.creators_by_document.clear()
+        self.words.start_bulk()
+        try:
+            async for document in collection.find({}, {"creator.@list.name": 1}):
+                self.update(document)
+        except Exception as exp:
+            logger.exception(f"Failed to load the creator index, falling back to Atlas Search.\n Error: {str(exp)}")
+            return
+        finally:
+            self.words.end_bulk()
+        self.ready = True
+        logger.info(f"Loaded {len(self.counts)} distinct creators")
+
+    def update(self, document: dict):
+        self.remove(document["_id"])
+        creators = (document.get("creator") or {}).get("@list") or []
+        names = {creator["name"].strip() for creator in creators if creator.get("name")}
+        self.creators_by_document[document["_id"]] = names
+        for name in names:
+            if self.counts[name] == 0:
+                for word in name.split():
+                    self.words.add(normalize_name(word), name)
+            self.counts[name] += 1
+
+    def remove(self, _id):
+        for name in self.creators_by_document.pop(_id, set()):
+            self.counts[name] -= 1
+            if self.counts[name] <= 0:
+                del self.counts[name]
+                for word in name.split():
+                    self.words.discard(normalize_name(word), name)
+
+    def search(self, name: str, page_size: int = 30) -> list:
+        scores = defaultdict(float)
+        for name_word in name.split():
+            name_word = normalize_name(name_word)
+            if len(name_word) < self.min_prefix_length:
+                continue
+            matches = self.words.lookup(name_word, fuzzy=False)
+            if sum(len(self.words.items(word)) for word in matches) < page_size:
+                matches = self.words.lookup(name_word)
+            # the best matching word of each name counts once per query word
+            word_scores = defaultdict(float)
+            for word, exact in matches.items():
+                score = EXACT_MATCH_SCORE if exact else FUZZY_MATCH_SCORE
+                for creator in self.words.items(word):
+                    word_scores[creator] = max(score, word_scores[creator])
+            for creator, score in word_scores.items():
+                scores[creator] += score
+
+        def rank(creator):
+            return -scores[creator], -self.counts[creator], creator
+
+        return heapq.nsmallest(page_size, scores, key=rank)
+
+
+typeahead_index = TypeaheadIndex()
+creator_index = CreatorIndex()
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+from pathlib import Path
+from urllib.parse import quote
+
+from dspback.config import get_settings
+from dspback.utils.cache import TTLCache
+
+logger = logging.getLogger()
+
+
+class AwardVocabulary:
+    """
+    Looks up grants in the Zenodo award vocabulary by award number.  Found awards are cached for ttl seconds and
+    numbers missing from the vocabulary for negative_ttl seconds, failed lookups are not cached.  Concurrent lookups
+    of the same number share one request.
+    """
+
+    url = "https://zenodo.org/api/awards?q="
+
+    def __init__(self, max_size: int = 1024, ttl: float = 86400, negative_ttl: float = 3600):
+        self.awards = TTLCache(max_size, ttl)
+        self.missing = TTLCache(max_size, negative_ttl)
+        self._pending = {}
+
+    async def clear(self):
+        await self.awards.clear()
+        await self.missing.clear()
+
+    async def lookup(self, client, number: str):
+        """Returns the grant fields of the award, or None when it is not in the vocabulary"""
+        award = await self.awards.get(number)
+        if award is not None:
+            return award
+        if await self.missing.get(number):
+            return None
+        if number not in self._pending:
+            fetch = asyncio.ensure_future(self._fetch(client, number))
+            fetch.add_done_callback(lambda _: self._pending.pop(number, None))
+            self._pending[number] = fetch
+        return await asyncio.shield(self._pending[number])
+
+    async def _fetch(self, client, number: str):
+        try:
+            response = await client.get(self.url + quote(number, safe=''))
+            results = json.loads(response.text)['hits']['hits']
+        except Exception as exp:
+            logger.warning(f"Failed to look up award {number}\n Error: {str(exp)}")
+            return None
+        for result in results:
+            if result['number'] == number:
+                award = {
+                    "id": result['id'],
+                    "number": result['number'],
+                    "title": result['title']['en'],
+                    "fundingAgency": result['funder']['name'],
+                }
+                await self.awards.set(number, award)
+                return award
+        await self.missing.set(number, True)
+        return None
+
+    async def resolve(self, client, numbers: list) -> dict:
+        """Looks up all the award numbers at once, returns the awards found by number"""
+        numbers = list({number for number in numbers if number})
+        awards = await asyncio.gather(*[self.lookup(client, number) for number in numbers])
+        return {number: award for number, award in zip(numbers, awards) if award is not None}
+
+
+LICENSE_SNAPSHOT = Path(__file__).parent.parent / "schemas" / "zenodo" / "licenses.json"
+
+
+class LicenseVocabulary:
+    """
+    The Zenodo license vocabulary held in memory.  Warmed at startup from the snapshot written by
+    management/refresh_zenodo_licenses.py and refreshed in bulk from Zenodo in the background.  A license missing from
+    memory is fetched on its own from the vocabulary endpoint and kept.
+    """
+
+    url = "https://zenodo.org/api/vocabularies/licenses?page=1&size=5000"
+    license_url = "https://zenodo.org/api/vocabularies/licenses/"
+
+    def __init__(self):
+        self.licenses = {}
+
+    def __len__(self):
+        return len(self.licenses)
+
+    def get(self, license_id: str):
+        """Returns a copy of the license in the schema fields, or None for ids not held in memory"""
+        license = self.licenses.get(license_id)
+        return dict(license) if license else None
+
+    async def lookup(self, client, license_id: str):
+        """Returns a copy of the license, fetching it when it is not held in memory, or None when it is not found"""
+        license = self.get(license_id)
+        if license is not None:
+            return license
+        try:
+            response = await client.get(self.license_url + quote(license_id, safe=''))
+            license = self._license(json.loads(response.text))
+        except Exception as exp:
+            logger.warning(f"Failed to look up license {license_id}\n Error: {str(exp)}")
+            return None
+        self.licenses[license_id] = license
+        return dict(license)
+
+    def load_snapshot(self, path: Path = LICENSE_SNAPSHOT):
+        with open(path) as f:
+            self.licenses = {license["id"]: license for license in json.load(f)}
+
+    def save_snapshot(self, path: Path = LICENSE_SNAPSHOT):
+        with open(path, "w") as f:
+            json.dump(sorted(self.licenses.values(), key=lambda license: license["id"]), f, indent=2)
+            f.write("\n")
+
+    @staticmethod
+    def _license(result: dict) -> dict:
+        return {
+            "id": result['id'],
+            "name": result['title']['en'],
+            "description": result.get('description', {}).get('en', ""),
+            "url": result.get('props', {}).get('url', ""),
+        }
+
+    async def refresh(self, client) -> bool:
+        try:
+            response = await client.get(self.url)
+            results = json.loads(response.text)['hits']['hits']
+            licenses = {result['id']: self._license(result) for result in results}
+        except Exception as exp:
+            logger.warning(f"Failed to refresh the Zenodo license vocabulary, keeping {len(self)}\n Error: {str(exp)}")
+            return False
+        if licenses:
+            self.licenses = licenses
+        return bool(licenses)
+
+    async def refresh_periodically(self, client, interval: float):
+        while True:
+            await self.refresh(client)
+            await asyncio.sleep(interval)
+
+
+award_vocabulary = AwardVocabulary(
+    get_settings().zenodo_award_cache_size,
+    get_settings().zenodo_award_cache_ttl_seconds,
+    get_settings().zenodo_award_negative_ttl_seconds,
+)
+
+license_vocabulary = LicenseVocabulary()
+license_vocabulary.load_snapshot()
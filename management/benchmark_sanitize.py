@@ -0,0 +1,61 @@
+import asyncio
+import re
+import sys
+import timeit
+
+import motor
+
+from dspback.config import get_settings
+from dspback.triggers import sanitize
+
+'''
+This script compares the time to sanitize the typeahead text of discovery records with the single-pass sanitize of
+the discovery trigger and with the regex passes it replaced.  The names, descriptions and keywords of up to LIMIT
+discovery records are used (1000 by default).
+
+Example call:
+
+docker exec dspback python management/benchmark_sanitize.py 5000
+'''
+
+
+def regex_sanitize(text):
+    """The regex passes the single-pass sanitize replaced, the reference its results are checked against"""
+    text = re.sub(r'https?://\S+', '', text)
+    text = re.sub(r"\b[a-zA-Z](?<!a)\b", "", text)
+    text = re.sub('[()/]', ' ', text)
+    text = re.sub('--', '', text)
+    text = re.sub(r'[^a-zA-Z0-9,\-_ ]', '', text)
+    words = text.split(' ')
+    for i in range(len(words)):
+        words[i] = words[i].strip("-")
+    text = " ".join(words)
+    text = " ".join(text.split())
+    return text
+
+
+async def discovery_texts(limit: int) -> list:
+    db = motor.motor_asyncio.AsyncIOMotorClient(get_settings().mongo_url)[get_settings().mongo_database]
+    texts = []
+    projection = {"name": 1, "description": 1, "keywords": 1}
+    async for document in db["discovery"].find({}, projection).limit(limit):
+        texts.append(document.get("name") or "")
+        texts.append(document.get("description") or "")
+        texts.extend(document.get("keywords") or [])
+    return texts
+
+
+def benchmark(texts: list, number: int):
+    same = all(sanitize(text) == regex_sanitize(text) for text in texts)
+    fast = timeit.timeit(lambda: [sanitize(text) for text in texts], number=number) / number
+    regex = timeit.timeit(lambda: [regex_sanitize(text) for text in texts], number=number) / number
+    size = sum(len(text) for text in texts) / 1024
+    print(
+        f"{len(texts)} texts, {size:.0f} KB, single pass {fast * 1000:.1f} ms, regex passes {regex * 1000:.1f} ms, "
+        f"{regex / fast if fast else 0:.1f}x, same result: {same}"
+    )
+
+
+if __name__ == "__main__":
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    benchmark(asyncio.run(discovery_texts(limit)), number=10)
@@ -0,0 +1,58 @@
+import json
+import sys
+import timeit
+from pathlib import Path
+
+from dspback.utils.jsonld.scraper import find_script, soup_find_script
+
+'''
+This script compares the time to find the json-ld script of landing pages with the fast path and with BeautifulSoup.
+Pass captured landing pages (saved html files) to benchmark them, without arguments a generated page the size of a
+large HydroShare resource landing page is used.
+
+Example call:
+
+docker exec dspback python management/benchmark_scrape_jsonld.py captured/*.html
+'''
+
+SCRIPT_MATCHES = [{"id": "schemaorg"}, {"type": "application/ld+json"}]
+
+
+def generated_page() -> str:
+    with open(Path(__file__).parent.parent / "tests" / "data" / "earthchem_jsonld.json") as f:
+        json_ld = f.read()
+    files = "".join(f"<tr><td class='name'>contents/file_{i}.csv</td><td>{i} KB</td></tr>" for i in range(5000))
+    return (
+        "<!DOCTYPE html><html><head><title>Resource</title><script src='/static/js/app.js'></script>"
+        f"<script id=\"schemaorg\" type=\"application/ld+json\">{json_ld}</script></head>"
+        f"<body><table>{files}</table></body></html>"
+    )
+
+
+def script_match(page: str) -> dict:
+    for match in SCRIPT_MATCHES:
+        if find_script(page, match) is not None:
+            return match
+    return SCRIPT_MATCHES[-1]
+
+
+def benchmark(name: str, page: str, number: int):
+    match = script_match(page)
+    fast_script = find_script(page, match)
+    soup_script = soup_find_script(page, match)
+    same = fast_script is not None and json.loads(fast_script) == json.loads(soup_script or "null")
+    fast = timeit.timeit(lambda: find_script(page, match), number=number) / number
+    soup = timeit.timeit(lambda: soup_find_script(page, match), number=number) / number
+    print(
+        f"{name}: {len(page) / 1024:.0f} KB, fast {fast * 1000:.2f} ms, soup {soup * 1000:.2f} ms, "
+        f"{soup / fast if fast else 0:.0f}x, same result: {same}"
+    )
+
+
+if __name__ == "__main__":
+    number = 20
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            benchmark(path, Path(path).read_text(), number)
+    else:
+        benchmark("generated", generated_page(), number)
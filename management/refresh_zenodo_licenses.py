@@ -0,0 +1,26 @@
+import asyncio
+
+import httpx
+
+from dspback.utils.vocabulary import license_vocabulary
+
+'''
+This script replaces the bundled snapshot of the Zenodo license vocabulary (dspback/schemas/zenodo/licenses.json)
+with the current vocabulary.  The api warms its license cache from the snapshot at startup.
+
+Example call:
+
+docker exec dspback python management/refresh_zenodo_licenses.py
+'''
+
+
+async def main():
+    async with httpx.AsyncClient(timeout=60) as client:
+        if not await license_vocabulary.refresh(client):
+            raise SystemExit("Failed to download the license vocabulary")
+    license_vocabulary.save_snapshot()
+    print(f"Saved {len(license_vocabulary)} licenses")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
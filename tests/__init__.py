@@ -1,7 +1,9 @@
+import asyncio
 import json
 import os
 import secrets
 from datetime import datetime, timedelta
+from types import SimpleNamespace
 from unittest.mock import patch
 
 import motor
@@ -9,12 +11,15 @@ import pytest
 from asgi_lifespan import LifespanManager
 from authlib.integrations.starlette_client import StarletteRemoteApp
 from beanie import init_beanie
-from httpx import AsyncClient
+from httpx import AsyncClient, MockTransport, Request, Response
+from pymongo.errors import BulkWriteError
 from starlette.testclient import TestClient
 
 from dspback.api import app
 from dspback.config import get_settings
 from dspback.pydantic_schemas import JSONLD, RepositoryToken, Submission, User
+from dspback.routers import metadata_class
+from dspback.utils.http import repository_base_url, repository_clients
 
 prefix = "/api"
 
@@ -177,3 +182,171 @@ async def earthchem(change_test_dir):
 async def earthchem_jsonld(change_test_dir):
     with open("data/earthchem_jsonld.json", "r") as f:
         return json.loads(f.read())
+
+
+class MockCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def to_list(self, length):
+        return list(self.documents)
+
+    async def __aiter__(self):
+        for document in self.documents:
+            yield document
+
+
+class MockChangeStream:
+    """A change stream over the given changes, opening it raises error"""
+
+    def __init__(self, changes=(), error=None):
+        self.changes = changes
+        self.error = error
+        self.resume_token = {"_data": "now"}
+        self.read = 0
+        self.closed = False
+
+    async def __aenter__(self):
+        if self.error:
+            raise self.error
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def __aiter__(self):
+        for change in self.changes:
+            self.read += 1
+            yield change
+
+    async def close(self):
+        self.closed = True
+
+
+class MockCollection:
+    """
+    The collection methods used by the triggers, the scheduler and the indexes.  Reads and deletes are recorded in
+    queries, aggregation pipelines in pipelines and bulk writes in writes, bulk writes fail for the operations in
+    invalid.  Count pipelines return counts.  Opening a change stream that resumes raises error, the change streams
+    opened deliver changes.
+    """
+
+    def __init__(self, documents=None, counts=None):
+        self.documents = documents or []
+        self.counts = counts or []
+        self.queries = []
+        self.pipelines = []
+        self.writes = []
+        self.invalid = []
+        self.watches = []
+        self.streams = []
+        self.changes = ()
+        self.error = None
+
+    def find(self, filter=None, projection=None):
+        self.queries.append((filter, projection))
+        if projection is None:
+            return MockCursor(self.documents)
+        fields = {path.split(".")[0] for path, included in projection.items() if included}
+        if projection.get("_id", 1):
+            fields.add("_id")
+        return MockCursor([{key: value for key, value in d.items() if key in fields} for d in self.documents])
+
+    def aggregate(self, stages, **kwargs):
+        self.pipelines.append(stages)
+        if '$count' in stages[-1] or '$searchMeta' in stages[-1]:
+            return MockCursor(self.counts)
+        return MockCursor([dict(document) for document in self.documents])
+
+    async def find_one(self, filter):
+        return next((document for document in self.documents if document["_id"] == filter["_id"]), None)
+
+    async def replace_one(self, filter, document, upsert):
+        self.documents = [d for d in self.documents if d["_id"] != filter["_id"]] + [document]
+
+    async def insert_one(self, document):
+        self.documents.append(document)
+
+    async def delete_many(self, filter):
+        self.queries.append(filter)
+        deleted = filter["repository_identifier"]["$in"]
+        return SimpleNamespace(deleted_count=len(deleted))
+
+    async def bulk_write(self, operations, ordered):
+        assert not ordered
+        self.writes.append(operations)
+        errors = [
+            {"index": i, "errmsg": "invalid"} for i, operation in enumerate(operations) if operation in self.invalid
+        ]
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    def watch(self, **kwargs):
+        self.watches.append(kwargs)
+        stream = MockChangeStream(self.changes, self.error if "resume_after" in kwargs else None)
+        self.streams.append(stream)
+        return stream
+
+
+class MockDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, MockCollection())
+
+
+class MockApi:
+    """An api behind an httpx mock transport, the requests it answered are recorded"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+
+    async def __call__(self, request: Request) -> Response:
+        self.requests.append(request)
+        response = self.handler(request)
+        if asyncio.iscoroutine(response):
+            response = await response
+        return response
+
+    def client(self, **kwargs) -> AsyncClient:
+        return AsyncClient(transport=MockTransport(self), **kwargs)
+
+
+@pytest.fixture
+def mock_repository(monkeypatch):
+    """Serves the api of a repository from handler(request), for the metadata routes and the vocabularies"""
+
+    def serve(repository_type, handler) -> MockApi:
+        api = MockApi(handler)
+        client = api.client(base_url=repository_base_url(repository_type))
+        monkeypatch.setitem(repository_clients._clients, repository_type, client)
+        return api
+
+    return serve
+
+
+@pytest.fixture
+def metadata_routes(monkeypatch):
+    """
+    Creates the metadata routes of a repository for a user with an access token, the records submitted are recorded
+    as (identifier, metadata) in the list returned with them.
+    """
+    submitted = []
+
+    async def submit_record(repository_type, identifier, user, metadata):
+        submitted.append((identifier, metadata))
+
+    async def access_token(request):
+        return "token"
+
+    monkeypatch.setattr(metadata_class, "submit_record", submit_record)
+
+    def create(cls, write_through: bool = True):
+        settings = get_settings().copy(update={"repository_write_through": write_through})
+        routes = cls(user=None, settings=settings)
+        routes.access_token = access_token
+        return routes, submitted
+
+    return create
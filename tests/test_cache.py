@@ -0,0 +1,68 @@
+import pytest
+
+from dspback.utils.cache import SearchCache, TTLCache, cache_key
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.asyncio
+async def test_ttl_cache_expires_entries():
+    timer = FakeTimer()
+    cache = TTLCache(max_size=10, ttl=5, timer=timer)
+    await cache.set("key", {"docs": []})
+    assert await cache.get("key") == {"docs": []}
+    timer.now = 5
+    assert await cache.get("key") is None
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    await cache.set("a", 1)
+    await cache.set("b", 2)
+    await cache.get("a")
+    await cache.set("c", 3)
+    assert await cache.get("a") == 1
+    assert await cache.get("b") is None
+    assert await cache.get("c") == 3
+
+
+@pytest.mark.asyncio
+async def test_search_cache_stats_and_clear():
+    cache = SearchCache(TTLCache(max_size=10, ttl=60))
+    assert await cache.get("key") is None
+    await cache.set("key", {"docs": [{"name": "a"}]})
+    assert await cache.get("key") == {"docs": [{"name": "a"}]}
+    await cache.clear()
+    assert await cache.get("key") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_search_cache_uses_shared_backend():
+    shared = TTLCache(max_size=10, ttl=60)
+    await shared.set("key", {"docs": []})
+    cache = SearchCache(TTLCache(max_size=10, ttl=60), shared=shared)
+    assert await cache.get("key") == {"docs": []}
+    assert await cache.get("key") == {"docs": []}
+    assert cache.stats()["shared_hits"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_key_is_canonical():
+    key = cache_key("search", {"term": " soil  moisture", "clusters": ["b", "a"], "sortBy": None, "pageNumber": 1})
+    assert key == cache_key("search", {"pageNumber": 1, "clusters": ["a", "b"], "term": "soil moisture"})
+    assert key != cache_key("search", {"pageNumber": 2, "clusters": ["a", "b"], "term": "soil moisture"})
+    assert key != cache_key("search_fuzzy", {"pageNumber": 1, "clusters": ["a", "b"], "term": "soil moisture"})
@@ -0,0 +1,269 @@
+import io
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pyarrow.ipc
+import pyarrow.parquet
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from dspback.routers.discovery import (
+    aggregate_cursor_stages,
+    aggregate_stages,
+    base_search,
+    decode_cursor,
+    encode_cursor,
+    fuzzy_search_stages,
+    report_filters,
+    search_fuzzy_count,
+    search_fuzzy_feedback_count,
+)
+from dspback.schemas.discovery import CountStrategy
+from dspback.utils.export import (
+    arrow_chunks,
+    csv_chunks,
+    format_report_row,
+    ndjson_chunks,
+    parquet_chunks,
+    report_rows,
+)
+from tests import MockCollection, MockCursor
+
+
+class MockClient:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getitem__(self, database):
+        return {"discovery": self.collection}
+
+
+class MockRequest:
+    def __init__(self, collection):
+        self.app = SimpleNamespace(db=MockClient(collection))
+
+
+async def search_stages(**kwargs):
+    params = dict(
+        clusters=None,
+        contentType=None,
+        creatorName=None,
+        dataCoverageEnd=None,
+        dataCoverageStart=None,
+        providerName=None,
+        publishedEnd=None,
+        publishedStart=None,
+        sortBy=None,
+    )
+    params.update(kwargs)
+    return await base_search(**params)
+
+
+@pytest.mark.asyncio
+async def test_cursor_round_trip():
+    _id = ObjectId()
+    created = datetime(2022, 5, 1)
+    cursor = encode_cursor("dateCreated", [created, _id])
+    assert decode_cursor(cursor, "dateCreated") == [created, _id]
+
+    with pytest.raises(HTTPException):
+        decode_cursor(cursor, "name")
+    with pytest.raises(HTTPException):
+        decode_cursor("not a cursor", "name")
+
+
+@pytest.mark.asyncio
+async def test_local_cursor_pagination():
+    _id = ObjectId()
+    collection = MockCollection([{"name": "a", "_cursor": ["a", ObjectId()]}, {"name": "b", "_cursor": ["b", _id]}])
+    _, _, _, stages = await search_stages(sortBy="name")
+
+    page = await aggregate_cursor_stages(MockRequest(collection), stages, sortBy="name", pageSize=2)
+    assert page["docs"] == [{"name": "a"}, {"name": "b"}]
+    assert decode_cursor(page["meta"]["cursor"], "name") == ["b", _id]
+    assert "count" not in page["meta"]
+    assert {'$sort': {'name': 1, '_id': 1}} in collection.pipelines[0]
+    assert collection.pipelines[0][-1] == {'$limit': 2}
+
+    collection.documents = [{"name": "c", "_cursor": ["c", ObjectId()]}]
+    page = await aggregate_cursor_stages(MockRequest(collection), stages, "name", page["meta"]["cursor"], 2)
+    assert page["meta"]["cursor"] is None
+    assert collection.pipelines[1][0] == {
+        '$match': {'$or': [{'name': {'$gt': 'b'}}, {'name': 'b', '_id': {'$gt': _id}}]}
+    }
+
+
+@pytest.mark.asyncio
+async def test_search_cursor_pagination():
+    collection = MockCollection([{"name": "a", "_cursor": "token"}])
+    _, _, _, stages = await search_stages(sortBy="dateCreated")
+    stages.insert(0, {'$search': {'index': 'fuzzy_search', 'compound': {}}})
+
+    cursor = encode_cursor("dateCreated", "previous")
+    page = await aggregate_cursor_stages(MockRequest(collection), stages, "dateCreated", cursor, 1)
+    search = collection.pipelines[0][0]['$search']
+    assert search['searchAfter'] == "previous"
+    assert search['sort'] == {'dateCreated': -1, '_id': 1}
+    assert not any('$sort' in stage for stage in collection.pipelines[0])
+    assert decode_cursor(page["meta"]["cursor"], "dateCreated") == "token"
+
+
+@pytest.mark.asyncio
+async def test_deferred_count():
+    collection = MockCollection([{"name": "a"}])
+    _, _, _, stages = await search_stages()
+
+    page = await aggregate_stages(MockRequest(collection), stages, 3, 10, CountStrategy.deferred)
+    assert page == {"docs": [{"name": "a"}]}
+    assert len(collection.pipelines) == 1
+    assert collection.pipelines[0][-2:] == [{"$skip": 20}, {"$limit": 10}]
+
+
+class FuzzyCountCollection(MockCollection):
+    """Only the fuzzy variant of the search matches"""
+
+    def aggregate(self, stages, **kwargs):
+        self.pipelines.append(stages)
+        should = stages[0]['$search']['compound']['should']
+        return MockCursor([{"count": 7}] if 'fuzzy' in should[0]['autocomplete'] else [])
+
+
+@pytest.mark.asyncio
+async def test_fuzzy_deferred_counts():
+    params = dict(
+        term="soil",
+        contentType=None,
+        providerName=None,
+        creatorName=None,
+        dataCoverageStart=None,
+        dataCoverageEnd=None,
+        publishedStart=None,
+        publishedEnd=None,
+        clusters=None,
+    )
+    collection = FuzzyCountCollection([])
+    assert await search_fuzzy_count.__wrapped__(MockRequest(collection), **params) == {"count": {"total": 7}}
+    assert collection.pipelines[0][-1] == {'$count': 'count'}
+    stages = await fuzzy_search_stages("soil", True, None, None, None, None, None, None, None, None, None)
+    assert collection.pipelines[0] == stages + [{'$count': 'count'}]
+
+    collection = FuzzyCountCollection([])
+    assert await search_fuzzy_feedback_count.__wrapped__(MockRequest(collection), **params) == {"count": {"total": 7}}
+    assert len(collection.pipelines) == 2
+
+
+@pytest.mark.asyncio
+async def test_approximate_count_from_search_meta():
+    collection = MockCollection([{"name": "a"}], counts=[{"count": {"lowerBound": 1000}}])
+    _, _, _, stages = await search_stages()
+    stages.insert(0, {'$search': {'index': 'fuzzy_search', 'compound': {}, 'highlight': {'path': ['name']}}})
+
+    page = await aggregate_stages(MockRequest(collection), stages, 1, 10, CountStrategy.approximate)
+    assert page["meta"]["count"] == {"lowerBound": 1000}
+    search_meta = collection.pipelines[1][0]['$searchMeta']
+    assert search_meta == {
+        'index': 'fuzzy_search',
+        'compound': {},
+        'count': {'type': 'lowerBound', 'threshold': 1000},
+    }
+
+
+@pytest.mark.asyncio
+async def test_approximate_count_with_filters():
+    collection = MockCollection([{"name": "a"}], counts=[{"count": 12}])
+    _, _, _, stages = await search_stages(clusters=["Urban Cluster"], sortBy="name")
+
+    page = await aggregate_stages(MockRequest(collection), stages, 1, 10, CountStrategy.approximate)
+    assert page["meta"]["count"] == {"total": 12}
+    count_pipeline = collection.pipelines[1]
+    assert count_pipeline[-2:] == [{'$limit': 1000}, {'$count': 'count'}]
+    assert not any('$sort' in stage for stage in count_pipeline)
+
+
+@pytest.mark.asyncio
+async def test_csv_chunks():
+    async def rows():
+        for name in ["a", "b", "c"]:
+            yield format_report_row(
+                {
+                    "name": name,
+                    "keywords": ["soil", "water"],
+                    "provider": {"name": "HydroShare"},
+                    "funding": [{"identifier": "2012669"}, {"name": "no identifier"}],
+                    "dateCreated": datetime(2022, 5, 1),
+                    "legacy": False,
+                }
+            )
+
+    chunks = [chunk async for chunk in csv_chunks(rows(), chunk_size=2)]
+    assert len(chunks) == 2
+    lines = "".join(chunks).splitlines()
+    assert lines[0] == ",name,description,keywords,datePublished,dateCreated,provider,funding,clusters,url,legacy"
+    assert lines[1] == "0,a,,\"['soil', 'water']\",,2022-05-01 00:00:00,HydroShare,['2012669'],,,False"
+    assert lines[3].startswith("2,c,")
+
+
+report_documents = [
+    {
+        "name": name,
+        "keywords": ["soil"],
+        "provider": {"name": "HydroShare"},
+        "funding": [{"identifier": "2012669"}],
+        "dateCreated": datetime(2022, 5, 1),
+        "legacy": False,
+    }
+    for name in ["a", "b", "c"]
+]
+
+
+@pytest.mark.asyncio
+async def test_ndjson_chunks():
+    collection = MockCollection(report_documents)
+    chunks = [chunk async for chunk in ndjson_chunks(report_rows(collection), chunk_size=2)]
+    assert len(chunks) == 2
+    lines = "".join(chunks).splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[0]) == {
+        "name": "a",
+        "keywords": ["soil"],
+        "provider": "HydroShare",
+        "funding": ["2012669"],
+        "dateCreated": "2022-05-01T00:00:00",
+        "legacy": False,
+    }
+    assert collection.pipelines[0][-1]['$project']['_id'] == 0
+
+
+@pytest.mark.asyncio
+async def test_parquet_chunks():
+    collection = MockCollection(report_documents)
+    rows = report_rows(collection, fields=["name", "provider", "dateCreated"])
+    chunks = [chunk async for chunk in parquet_chunks(rows, ["name", "provider", "dateCreated"], chunk_size=2)]
+    table = pyarrow.parquet.read_table(io.BytesIO(b"".join(chunks)))
+    assert table.column_names == ["name", "provider", "dateCreated"]
+    assert table.column("name").to_pylist() == ["a", "b", "c"]
+    assert table.column("dateCreated").to_pylist()[0] == datetime(2022, 5, 1)
+    assert pyarrow.parquet.ParquetFile(io.BytesIO(b"".join(chunks))).num_row_groups == 2
+
+
+@pytest.mark.asyncio
+async def test_arrow_chunks():
+    collection = MockCollection(report_documents)
+    chunks = [chunk async for chunk in arrow_chunks(report_rows(collection), chunk_size=2)]
+    table = pyarrow.ipc.open_stream(b"".join(chunks)).read_all()
+    assert table.num_rows == 3
+    assert table.column("funding").to_pylist()[0] == ["2012669"]
+    assert table.column("description").to_pylist() == [None, None, None]
+
+
+@pytest.mark.asyncio
+async def test_report_filters():
+    stages, fields = await report_filters(providerName="HydroShare", clusters=None, fields=["name"])
+    assert fields == ["name"]
+    assert '$search' in stages[0]
+    assert not any('$set' in stage or '$unset' in stage for stage in stages)
+
+    with pytest.raises(HTTPException):
+        await report_filters(clusters=None, fields=["name", "secret"])
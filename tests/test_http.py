@@ -0,0 +1,170 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from dspback import api
+from dspback.config import get_settings
+from dspback.pydantic_schemas import RepositoryType
+from dspback.routers.hydroshare import HydroShareMetadataRoutes
+from dspback.schemas.hydroshare.model import ResourceMetadata
+from dspback.utils.executor import parse_pool
+from dspback.utils.http import RepositoryClients, SharedSession, http_session, repository_base_url
+from dspback.utils.jsonld.scraper import NotModified, fetch_landing_page
+from tests import change_test_dir, hydroshare, metadata_routes, mock_repository
+
+
+@pytest.mark.asyncio
+async def test_shared_session():
+    shared = SharedSession()
+    session = shared.get()
+    assert shared.get() is session
+    assert session.connector.limit == get_settings().http_pool_size
+    assert session.connector.limit_per_host == get_settings().http_pool_size_per_host
+
+    await shared.close()
+    assert session.closed
+    assert shared.get() is not session
+    await shared.close()
+
+
+@pytest.mark.asyncio
+async def test_fetch_landing_page_conditional():
+    async def landing_page(request):
+        if request.headers.get("If-None-Match") == '"1"':
+            return web.Response(status=304)
+        return web.Response(text="<html></html>", headers={"ETag": '"1"'})
+
+    app = web.Application()
+    app.router.add_get("/resource", landing_page)
+    async with TestServer(app) as server:
+        url = str(server.make_url("/resource"))
+        text, validators = await fetch_landing_page(url)
+        assert text == "<html></html>"
+        assert validators == {"etag": '"1"'}
+        with pytest.raises(NotModified):
+            await fetch_landing_page(url, validators)
+        # both requests went over one pooled connection
+        assert len(http_session.get().connector._conns) == 1
+    await http_session.close()
+
+
+@pytest.mark.asyncio
+async def test_repository_clients():
+    clients = RepositoryClients()
+    hydroshare = clients.get(RepositoryType.HYDROSHARE)
+    assert clients.get(RepositoryType.HYDROSHARE) is hydroshare
+    assert clients.get(RepositoryType.ZENODO) is not hydroshare
+    assert str(hydroshare.base_url).rstrip("/") == repository_base_url(RepositoryType.HYDROSHARE)
+    assert hydroshare.timeout.read == get_settings().repository_timeout_seconds
+    assert hydroshare.follow_redirects
+
+    await clients.close()
+    assert hydroshare.is_closed
+    assert clients.get(RepositoryType.HYDROSHARE) is not hydroshare
+    await clients.close()
+
+
+@pytest.mark.asyncio
+async def test_repository_calls_run_concurrently():
+    async def slow(request):
+        await asyncio.sleep(0.2)
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_get("/slow", slow)
+    clients = RepositoryClients()
+    async with TestServer(app) as server:
+        client = clients.get(RepositoryType.HYDROSHARE)
+        start = time.monotonic()
+        responses = await asyncio.gather(*[client.get(str(server.make_url("/slow"))) for _ in range(5)])
+        assert time.monotonic() - start < 0.5
+        assert [response.json() for response in responses] == [{"ok": True}] * 5
+    await clients.close()
+
+
+@pytest.mark.asyncio
+async def test_shutdown_closes_shared_resources(monkeypatch):
+    monkeypatch.setattr(api.app, "db", SimpleNamespace(close=lambda: None), raising=False)
+    session = http_session.get()
+    parse_pool._get()
+    stopped = []
+
+    async def trigger():
+        try:
+            await asyncio.Event().wait()
+        finally:
+            stopped.append((session.closed, parse_pool._executor is None))
+
+    monkeypatch.setattr(api.app, "background_tasks", [asyncio.create_task(trigger())], raising=False)
+    await asyncio.sleep(0)
+    await api.shutdown_db_client()
+    # the trigger was stopped while the session and the pool were still open
+    assert stopped == [(False, False)]
+    assert session.closed
+    assert parse_pool._executor is None
+
+
+def hydroshare_api(resource: dict):
+    """HydroShare's resource endpoints, metadata files posted are accepted and new resources are created as abc"""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            return httpx.Response(200, json=resource)
+        if request.headers["Content-Type"].startswith("multipart/form-data"):
+            return httpx.Response(202)
+        return httpx.Response(201, json={"resource_id": "abc"})
+
+    return handler
+
+
+def metadata_files(api) -> list:
+    return [request.content for request in api.requests if b'filename="resourcemetadata.xml"' in request.content]
+
+
+def hydroshare_resource(hydroshare: dict) -> dict:
+    """The resource as the HydroShare api returns it"""
+    resource = json.loads(json.dumps(hydroshare))
+    resource["additional_metadata"] = {}
+    return resource
+
+
+@pytest.mark.asyncio
+async def test_hydroshare_create_and_update(mock_repository, metadata_routes, hydroshare):
+    api = mock_repository(RepositoryType.HYDROSHARE, hydroshare_api(hydroshare_resource(hydroshare)))
+    routes, submitted = metadata_routes(HydroShareMetadataRoutes, write_through=False)
+    metadata = ResourceMetadata(**hydroshare)
+
+    response = await routes.create_metadata_repository(None, metadata)
+    assert response.status_code == 201
+    assert json.loads(response.body)["metadata"]["title"] == hydroshare["title"]
+    json_metadata = await routes.update_metadata(None, metadata, "abc")
+    assert json_metadata["metadata"]["title"] == hydroshare["title"]
+
+    files = metadata_files(api)
+    assert len(files) == 2
+    assert hydroshare["title"].encode() in files[0]
+    assert [identifier for identifier, _ in submitted] == ["abc", "abc"]
+
+
+@pytest.mark.asyncio
+async def test_hydroshare_create_write_through(mock_repository, metadata_routes, hydroshare):
+    api = mock_repository(RepositoryType.HYDROSHARE, hydroshare_api(hydroshare_resource(hydroshare)))
+    routes, submitted = metadata_routes(HydroShareMetadataRoutes)
+    payload = {key: value for key, value in hydroshare.items() if key != "spatial_coverage"}
+    metadata = ResourceMetadata(**payload)
+
+    response = await routes.create_metadata_repository(None, metadata)
+    assert response.status_code == 201
+    assert len(metadata_files(api)) == 1
+    # the record holds the metadata the rdf was written from, not the coverage the resource had before the update
+    _, submitted_metadata = submitted[0]
+    written = json.loads(metadata.json())
+    assert submitted_metadata["spatial_coverage"] == written["spatial_coverage"] != hydroshare["spatial_coverage"]
+    assert submitted_metadata["title"] == written["title"]
+    assert json.loads(response.body)["metadata"]["spatial_coverage"] is None
@@ -1,3 +1,4 @@
+import functools
 import json
 
 import pytest
@@ -6,8 +7,16 @@ from pydantic import BaseModel
 from dspback.pydantic_schemas import RepositoryType
 from dspback.scheduler import retrieve_submission_json_ld
 from dspback.schemas.discovery import JSONLD, Funding
-from dspback.utils.jsonld.clusters import clusters
-from dspback.utils.jsonld.scraper import format_fields, parse_funding_jsonld
+from dspback.utils.executor import ProcessPool
+from dspback.utils.jsonld.clusters import ClusterIndex, clusters, compare
+from dspback.utils.jsonld.scraper import (
+    find_script,
+    format_fields,
+    parse_discovery_jsonld,
+    parse_funding_jsonld,
+    scrape_jsonld,
+    soup_find_script,
+)
 from tests import change_test_dir, earthchem_jsonld
 
 ids_and_cluster = [
@@ -168,3 +177,65 @@ async def test_earthchem_jsonld(earthchem_jsonld):
     assert jsonld.funding[0].identifier == "http://www.nsf.gov/awardsearch/showAward.do?AwardNumber=2012123"
     assert len(jsonld.clusters) == 1
     assert jsonld.clusters[0] == "Big Data Cluster"
+
+
+@pytest.mark.asyncio
+async def test_cluster_index():
+    index = ClusterIndex()
+    index.update({"_id": 1, "clusters": ["Urban Cluster", "CZO Boulder"]})
+    index.update({"_id": 2, "clusters": ["Urban Cluster", "Bedrock Cluster"]})
+    index.update({"_id": 3})
+    assert index.counts == {"Urban Cluster": 2, "CZO Boulder": 1, "Bedrock Cluster": 1}
+    assert index.sorted_clusters == sorted(index.counts, key=functools.cmp_to_key(compare))
+
+    index.update({"_id": 2, "clusters": ["Urban Cluster"]})
+    assert "Bedrock Cluster" not in index.sorted_clusters
+    index.remove(1)
+    assert index.counts == {"Urban Cluster": 1}
+    assert index.sorted_clusters == ["Urban Cluster"]
+
+
+def landing_page(script: str, padding: int = 50) -> str:
+    rows = "".join(f"<tr><td class='name'>file_{i}.csv</td><td>{i} KB</td></tr>" for i in range(padding))
+    return (
+        "<!DOCTYPE html><html><head><title>Resource</title>"
+        "<script src='/static/js/app.js'></script>"
+        "<script type=\"text/javascript\">var x = '<b>not json</b>';</script>"
+        f"{script}</head><body><table>{rows}</table></body></html>"
+    )
+
+
+@pytest.mark.asyncio
+async def test_find_script_matches_soup(earthchem_jsonld):
+    text = json.dumps(earthchem_jsonld)
+    pages = [
+        (landing_page(f'<script type="application/ld+json">{text}</script>'), {"type": "application/ld+json"}),
+        (landing_page(f"<SCRIPT TYPE='application/ld+json' >{text}</SCRIPT >"), {"type": "application/ld+json"}),
+        (landing_page(f'<script id=schemaorg type="application/ld+json">{text}</script>'), {"id": "schemaorg"}),
+        (landing_page(f'<script type="application/ld+json" id="other">{text}</script>'), {"id": "schemaorg"}),
+        (landing_page(""), {"type": "application/ld+json"}),
+    ]
+    for page, script_match in pages:
+        assert find_script(page, script_match) == soup_find_script(page, script_match)
+    assert json.loads(find_script(pages[0][0], pages[0][1])) == earthchem_jsonld
+
+
+@pytest.mark.asyncio
+async def test_scrape_jsonld_falls_back_to_soup(earthchem_jsonld):
+    # the > inside the attribute value ends the tag early for the fast path
+    page = landing_page(f'<script data-note="a > b" type="application/ld+json">{json.dumps(earthchem_jsonld)}</script>')
+    assert find_script(page, {"type": "application/ld+json"}) is None
+    assert scrape_jsonld(page, {"type": "application/ld+json"}) == format_fields(dict(earthchem_jsonld))
+
+
+@pytest.mark.asyncio
+async def test_parse_discovery_jsonld_in_process_pool(earthchem_jsonld):
+    page = landing_page(f'<script type="application/ld+json">{json.dumps(earthchem_jsonld)}</script>')
+    inline = await ProcessPool(0).run(parse_discovery_jsonld, page, "id", RepositoryType.EARTHCHEM)
+    pool = ProcessPool(1)
+    try:
+        assert await pool.run(parse_discovery_jsonld, page, "id", RepositoryType.EARTHCHEM) == inline
+    finally:
+        pool.shutdown()
+    assert inline["repository_identifier"] == "id"
+    assert inline["provider"]["name"] == "EarthChem Library"
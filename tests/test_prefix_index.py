@@ -0,0 +1,106 @@
+import pytest
+from pydantic import parse_obj_as
+
+from dspback.schemas.discovery import TypeAhead
+from dspback.utils.prefix_index import CreatorIndex, PrefixIndex, TypeaheadIndex
+from tests import MockCollection
+
+documents = [
+    {
+        '_id': 1,
+        'name': 'Soil moisture at Reynolds Creek',
+        'description': 'Hourly soil moisture and temperature measured at five depths',
+        'keywords': ['soil', 'Reynolds Creek'],
+    },
+    {
+        '_id': 2,
+        'name': 'Stream chemistry',
+        'description': 'Major ion chemistry of stream water samples',
+        'keywords': ['water quality'],
+    },
+]
+
+
+@pytest.mark.asyncio
+async def test_prefix_index_lookup():
+    index = PrefixIndex()
+    for word in ["soil", "soils", "solar", "stream"]:
+        index.add(word, word)
+
+    assert index.lookup("soi", fuzzy=False) == {"soil": True, "soils": True}
+    # "so" is one deletion away from "soi"
+    assert index.lookup("soi") == {"soil": True, "soils": True, "solar": False}
+    assert index.lookup("stri") == {"stream": False}
+    # prefixes shorter than min_fuzzy_length only match exactly
+    assert index.lookup("sp") == {}
+
+    index.discard("soils", "soils")
+    assert index.lookup("soi", fuzzy=False) == {"soil": True}
+    assert len(index) == 3
+
+
+@pytest.mark.asyncio
+async def test_typeahead_index_search():
+    index = TypeaheadIndex()
+    await index.load(MockCollection(documents))
+    assert index.ready
+
+    results = index.search("moist")
+    assert len(results) == 1
+    parse_obj_as(list[TypeAhead], results)
+    paths = {highlight["path"] for highlight in results[0]["highlights"]}
+    assert paths == {"name", "description"}
+    name_highlight = [highlight for highlight in results[0]["highlights"] if highlight["path"] == "name"][0]
+    assert name_highlight["texts"] == [
+        {"value": "Soil ", "type": "text"},
+        {"value": "moisture", "type": "hit"},
+        {"value": " at Reynolds Creek", "type": "text"},
+    ]
+
+    # one edit away from "chemistry"
+    results = index.search("chenis")
+    assert len(results) == 1
+    assert results[0]["highlights"][0]["texts"][1] == {"value": "chemistry", "type": "hit"}
+
+
+@pytest.mark.asyncio
+async def test_typeahead_index_update_and_remove():
+    index = TypeaheadIndex()
+    await index.load(MockCollection(documents))
+
+    index.update({'_id': 2, 'name': 'Stream temperature', 'description': '', 'keywords': []})
+    assert index.search("chemistry") == []
+    assert len(index.search("temperature")) == 2
+
+    index.remove(1)
+    assert index.search("soil") == []
+    assert len(index.search("temperature")) == 1
+
+
+@pytest.mark.asyncio
+async def test_creator_index_search():
+    index = CreatorIndex()
+    await index.load(
+        MockCollection(
+            [
+                {'_id': 1, 'creator': {'@list': [{'name': 'Jane Smith'}, {'name': 'John Doe'}]}},
+                {'_id': 2, 'creator': {'@list': [{'name': 'Jane Smith'}, {'name': 'Jan Smythe'}]}},
+                {'_id': 3},
+            ]
+        )
+    )
+    assert len(index) == 3
+
+    # exact prefix matches rank above fuzzy matches
+    assert index.search("smi") == ["Jane Smith", "Jan Smythe"]
+    assert index.search("smi", page_size=1) == ["Jane Smith"]
+    # both names match "jan", the one on more records ranks first
+    assert index.search("jan") == ["Jane Smith", "Jan Smythe"]
+    assert index.search("jane smith") == ["Jane Smith", "Jan Smythe"]
+    assert index.search("smoth") == ["Jane Smith", "Jan Smythe"]
+
+    index.remove(2)
+    assert index.search("jan") == ["Jane Smith"]
+    index.update({'_id': 1, 'creator': {'@list': [{'name': 'John Doe'}]}})
+    assert index.search("jan") == []
+    assert index.counts == {"John Doe": 1}
@@ -0,0 +1,198 @@
+import asyncio
+from collections import Counter, defaultdict
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from pydantic import BaseModel
+
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+
+from dspback import scheduler
+from dspback.pydantic_schemas import RepositoryType
+from dspback.routers.discovery import search_landing_page_stats
+from dspback.scheduler import DiscoveryWriter, refresh_submission, refresh_submissions, sweep_orphans
+from dspback.utils.jsonld.fingerprint import CONTENT_HASH_FIELD, LANDING_PAGE_FIELD, content_hash
+from dspback.utils.jsonld.scraper import LandingPageStats, NotModified, conditional_headers, landing_page_stats
+from tests import MockCollection
+
+
+class MockSubmission(BaseModel):
+    repo_type: RepositoryType
+    identifier: str
+    url: str
+    metadata_json: str = "{}"
+
+
+async def submissions(count):
+    for i in range(count):
+        host = "www.hydroshare.org" if i % 2 else "zenodo.org"
+        yield SimpleNamespace(url=f"https://{host}/records/{i}", repo_type="hydroshare")
+
+
+@pytest.mark.asyncio
+async def test_refresh_submissions_limits():
+    running = Counter()
+    peaks = defaultdict(int)
+
+    async def refresh(submission):
+        host = submission.url.split("/")[2]
+        running["all"] += 1
+        running[host] += 1
+        peaks["all"] = max(peaks["all"], running["all"])
+        peaks[host] = max(peaks[host], running[host])
+        await asyncio.sleep(0.01)
+        running["all"] -= 1
+        running[host] -= 1
+        if submission.url.endswith("/7"):
+            raise ValueError("landing page unavailable")
+        return "upserted"
+
+    outcomes = await refresh_submissions(submissions(20), refresh, concurrency=5, host_concurrency=2)
+    assert outcomes == {"upserted": 19, "failed": 1}
+    assert peaks["all"] == 4
+    assert peaks["www.hydroshare.org"] == 2
+    assert peaks["zenodo.org"] == 2
+
+
+@pytest.mark.asyncio
+async def test_refresh_submissions_sequential():
+    order = []
+
+    async def refresh(submission):
+        order.append(submission.url)
+        await asyncio.sleep(0)
+        return "removed"
+
+    outcomes = await refresh_submissions(submissions(3), refresh, concurrency=1, host_concurrency=1)
+    assert outcomes == {"removed": 3}
+    assert order == [f"https://{'www.hydroshare.org' if i % 2 else 'zenodo.org'}/records/{i}" for i in range(3)]
+
+
+@pytest.mark.asyncio
+async def test_sweep_orphans():
+    submission_collection = MockCollection([{"identifier": "a"}, {"identifier": "b"}])
+    discovery = MockCollection([{"repository_identifier": key} for key in ["a", "b", "c", "d"]])
+
+    assert await sweep_orphans(submission_collection, discovery) == 2
+    assert len(discovery.queries) == 2
+    delete = discovery.queries[1]
+    assert sorted(delete["repository_identifier"]["$in"]) == ["c", "d"]
+    assert delete["legacy"] is False
+
+    discovery = MockCollection([{"repository_identifier": "a"}])
+    assert await sweep_orphans(submission_collection, discovery) == 0
+    assert len(discovery.queries) == 1
+
+
+@pytest.mark.asyncio
+async def test_discovery_writer_batches():
+    discovery = MockCollection([])
+    writer = DiscoveryWriter(discovery, batch_size=2)
+    await writer.replace({"repository_identifier": "a", "name": "A"})
+    assert discovery.writes == []
+    await writer.delete("b")
+    assert discovery.writes == [
+        [
+            ReplaceOne({"repository_identifier": "a"}, {"repository_identifier": "a", "name": "A"}, upsert=True),
+            DeleteOne({"repository_identifier": "b", "legacy": False}),
+        ]
+    ]
+    await writer.replace({"repository_identifier": "c"})
+    await writer.flush()
+    await writer.flush()
+    assert len(discovery.writes) == 2
+    assert writer.written == 3
+
+
+@pytest.mark.asyncio
+async def test_discovery_writer_partial_failure():
+    discovery = MockCollection([])
+    discovery.invalid = [DeleteOne({"repository_identifier": "b", "legacy": False})]
+    writer = DiscoveryWriter(discovery, batch_size=10)
+    await writer.replace({"repository_identifier": "a"})
+    await writer.delete("b")
+    await writer.flush()
+    assert writer.written == 1
+    assert writer.failed == 1
+
+
+@pytest.mark.asyncio
+async def test_discovery_writer_skips_unchanged():
+    record = {"repository_identifier": "a", "name": "A"}
+    record[CONTENT_HASH_FIELD] = content_hash(record)
+    discovery = MockCollection([])
+    writer = DiscoveryWriter(discovery, batch_size=10, fingerprints={"a": dict(record), "b": {}})
+
+    assert not await writer.replace(dict(record))
+    assert not await writer.delete("c")
+    changed = {"repository_identifier": "a", "name": "A changed"}
+    changed[CONTENT_HASH_FIELD] = content_hash(changed)
+    assert await writer.replace(changed)
+    assert await writer.delete("b")
+    await writer.flush()
+    assert writer.written == 2
+
+
+def test_content_hash():
+    record = {"name": "A", "keywords": ["soil", "water"], "dateCreated": datetime(2022, 5, 1)}
+    reordered = {"dateCreated": datetime(2022, 5, 1), "keywords": ["soil", "water"], "name": "A"}
+    assert content_hash(record) == content_hash(reordered)
+    assert content_hash(record) == content_hash({**record, "_id": 1, CONTENT_HASH_FIELD: "stale"})
+    assert content_hash(record) != content_hash({**record, "keywords": ["water", "soil"]})
+
+
+@pytest.mark.asyncio
+async def test_discovery_writer_keeps_new_validators():
+    record = {"repository_identifier": "a", "name": "A", LANDING_PAGE_FIELD: {"etag": '"1"'}}
+    record[CONTENT_HASH_FIELD] = content_hash(record)
+    discovery = MockCollection([])
+    writer = DiscoveryWriter(discovery, batch_size=10, fingerprints={"a": dict(record)})
+    assert writer.validators("a") == {"etag": '"1"'}
+    assert writer.validators("b") is None
+
+    assert not await writer.replace({**record, LANDING_PAGE_FIELD: {"etag": '"2"'}})
+    await writer.flush()
+    update = UpdateOne({"repository_identifier": "a"}, {"$set": {LANDING_PAGE_FIELD: {"etag": '"2"'}}})
+    assert discovery.writes == [[update]]
+
+
+@pytest.mark.asyncio
+async def test_refresh_submission_not_modified(monkeypatch):
+    async def not_modified(identifier, repository_type, url, validators):
+        assert validators == {"etag": '"1"'}
+        raise NotModified(url)
+
+    monkeypatch.setattr(scheduler, "retrieve_discovery_jsonld", not_modified)
+    writer = DiscoveryWriter(MockCollection([]), fingerprints={"a": {LANDING_PAGE_FIELD: {"etag": '"1"'}}})
+    submission = MockSubmission(repo_type=RepositoryType.HYDROSHARE, identifier="a", url="https://www.hydroshare.org/")
+    assert await refresh_submission(writer, submission) == "not_modified"
+    assert writer.operations == []
+
+
+def test_landing_page_stats():
+    stats = LandingPageStats()
+    for status in [304, 304, 200]:
+        stats.record(RepositoryType.HYDROSHARE, status)
+    stats.record(RepositoryType.ZENODO, 200)
+    ratios = stats.not_modified_ratios()
+    assert ratios[str(RepositoryType.HYDROSHARE)] == pytest.approx(2 / 3)
+    assert ratios[str(RepositoryType.ZENODO)] == 0
+    assert stats.stats()[str(RepositoryType.HYDROSHARE)] == {
+        "conditional": 3,
+        "not_modified": 2,
+        "not_modified_ratio": pytest.approx(2 / 3),
+    }
+    assert conditional_headers({"etag": '"1"', "last_modified": "Wed, 21 Oct 2015 07:28:00 GMT"}) == {
+        "If-None-Match": '"1"',
+        "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT",
+    }
+
+
+@pytest.mark.asyncio
+async def test_search_landing_page_stats():
+    landing_page_stats.clear()
+    landing_page_stats.record(RepositoryType.ZENODO, 304)
+    stats = await search_landing_page_stats()
+    assert stats == {str(RepositoryType.ZENODO): {"conditional": 1, "not_modified": 1, "not_modified_ratio": 1.0}}
+    landing_page_stats.clear()
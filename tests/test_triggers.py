@@ -0,0 +1,495 @@
+import asyncio
+import time
+import zlib
+from types import SimpleNamespace
+
+import pytest
+from bson import Timestamp
+from hypothesis import given
+from hypothesis import strategies as st
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import OperationFailure
+
+from dspback import triggers
+from dspback.routers.discovery import search_trigger_stats
+from dspback.triggers import (
+    DISCOVERY_WATCH_PIPELINE,
+    BatchStats,
+    LatencyStats,
+    ResumeTokens,
+    Watermark,
+    apply_discovery_changes,
+    change_lag_seconds,
+    coalesce,
+    discovery_batch_stats,
+    next_batch,
+    open_change_stream,
+    process_changes,
+    process_submission_change,
+    reconcile_typeahead,
+    sanitize,
+    submission_key,
+    submission_latency,
+    watch_discovery,
+    watch_with_retry,
+)
+from dspback.utils.jsonld.fingerprint import LANDING_PAGE_FIELD
+from dspback.utils.jsonld.clusters import cluster_index
+from dspback.utils.prefix_index import creator_index, typeahead_index
+from management.benchmark_sanitize import regex_sanitize
+from tests import MockChangeStream, MockCollection, MockDatabase
+
+
+def change(operation, _id, name="Soil moisture"):
+    event = {"operationType": operation, "documentKey": {"_id": _id}}
+    if operation != "delete":
+        event["fullDocument"] = {"_id": _id, "name": name, "description": "At (Reynolds) Creek", "keywords": ["soil"]}
+    return event
+
+
+@pytest.mark.asyncio
+async def test_next_batch_size_and_window():
+    queue = asyncio.Queue()
+    for i in range(5):
+        queue.put_nowait(i)
+    assert await next_batch(queue, max_size=3, window=1) == [0, 1, 2]
+
+    start = time.monotonic()
+    assert await next_batch(queue, max_size=3, window=0.05) == [3, 4]
+    assert time.monotonic() - start < 0.5
+
+
+def test_coalesce():
+    changes = [change("insert", 1), change("update", 2), change("update", 1, "Renamed"), change("delete", 2)]
+    coalesced = coalesce(changes)
+    assert [(event["operationType"], event["documentKey"]["_id"]) for event in coalesced] == [
+        ("update", 1),
+        ("delete", 2),
+    ]
+    assert coalesced[0]["fullDocument"]["name"] == "Renamed"
+
+
+@pytest.mark.asyncio
+async def test_apply_discovery_changes():
+    db = MockDatabase()
+    changes = [change("insert", "a"), change("update", "a", "Stream chemistry"), change("delete", "b")]
+    changes.append({"operationType": "update", "documentKey": {"_id": "c"}, "fullDocument": None})
+
+    assert await apply_discovery_changes(db, changes) == 2
+    assert db["typeahead"].writes == [
+        [
+            ReplaceOne(
+                {"_id": "a"},
+                {"_id": "a", "name": "Stream chemistry", "description": "At Reynolds Creek", "keywords": ["soil"]},
+                upsert=True,
+            ),
+            DeleteOne({"_id": "b"}),
+        ]
+    ]
+    assert "a" in typeahead_index.documents
+    typeahead_index.remove("a")
+
+
+@pytest.mark.asyncio
+async def test_apply_discovery_changes_sets_aside_failures():
+    db = MockDatabase()
+    bad = change("insert", "bad")
+    bad["fullDocument"]["name"] = 5
+    changes = [change("insert", "a"), bad, change("delete", "b"), change("delete", "c")]
+    db["typeahead"].invalid = [DeleteOne({"_id": "c"})]
+    failed = []
+
+    async def dead_letter(change, error):
+        failed.append(change["documentKey"]["_id"])
+
+    assert await apply_discovery_changes(db, changes, dead_letter) == 2
+    assert [operation._filter for operation in db["typeahead"].writes[0]] == [{"_id": "a"}, {"_id": "b"}, {"_id": "c"}]
+    assert failed == ["bad", "c"]
+    assert "bad" not in typeahead_index.documents
+    typeahead_index.remove("a")
+
+
+def test_batch_stats():
+    stats = BatchStats()
+    stats.record(10, 4, 2.5)
+    stats.record(2, 2, 0.5)
+    assert (stats.batches, stats.events, stats.writes) == (2, 12, 6)
+    assert stats.last_batch_size == 2
+    assert stats.max_lag_seconds == 2.5
+    assert stats.stats()["mean_batch_size"] == 6
+    assert BatchStats().stats()["mean_batch_size"] == 0.0
+    assert change_lag_seconds({"clusterTime": Timestamp(int(time.time()) - 5, 1)}) >= 5
+    assert change_lag_seconds({}) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_search_trigger_stats():
+    stats = await search_trigger_stats()
+    assert stats["discovery"] == discovery_batch_stats.stats()
+    assert stats["submissions"] == submission_latency.stats()
+
+
+@pytest.mark.asyncio
+async def test_resume_tokens():
+    tokens = ResumeTokens(MockCollection())
+    assert await tokens.load("discovery") is None
+    await tokens.save("discovery", {"_data": "1"})
+    await tokens.save("discovery", None)
+    await tokens.save("discovery", {"_data": "2"})
+    assert await tokens.load("discovery") == {"_data": "2"}
+    assert await tokens.load("Submission") is None
+
+
+@pytest.mark.asyncio
+async def test_open_change_stream_resumes():
+    db = MockDatabase()
+    tokens = ResumeTokens(db["resume_tokens"])
+    reconciled = []
+
+    async def reconcile(db):
+        reconciled.append(db)
+
+    stream = await open_change_stream(db, "discovery", tokens, reconcile, full_document="updateLookup")
+    # a restart before the first change resumes from the first open
+    assert await tokens.load("discovery") == stream.resume_token
+    await tokens.save("discovery", {"_data": "1"})
+    await open_change_stream(db, "discovery", tokens, reconcile, full_document="updateLookup")
+    assert db["discovery"].watches == [
+        {"full_document": "updateLookup"},
+        {"full_document": "updateLookup", "resume_after": {"_data": "1"}},
+    ]
+    assert reconciled == []
+
+
+@pytest.mark.asyncio
+async def test_open_change_stream_history_lost():
+    db = MockDatabase()
+    tokens = ResumeTokens(db["resume_tokens"])
+    await tokens.save("discovery", {"_data": "1"})
+    reconciled = []
+
+    async def reconcile(db):
+        reconciled.append(db)
+
+    db["discovery"].error = OperationFailure("history lost", code=286)
+    stream = await open_change_stream(db, "discovery", tokens, reconcile)
+    assert reconciled == [db]
+    assert db["discovery"].watches == [{"resume_after": {"_data": "1"}}, {}]
+    assert await tokens.load("discovery") == stream.resume_token
+
+    await tokens.save("discovery", {"_data": "1"})
+    db["discovery"].error = OperationFailure("unauthorized", code=13)
+    with pytest.raises(OperationFailure):
+        await open_change_stream(db, "discovery", tokens, reconcile)
+    assert len(reconciled) == 1
+
+
+@pytest.mark.asyncio
+async def test_watch_with_retry(monkeypatch):
+    db = MockDatabase()
+    clock = SimpleNamespace(now=0.0)
+    delays = []
+    runs = []
+
+    async def sleep(seconds):
+        delays.append(seconds)
+
+    async def watch(db):
+        runs.append(db)
+        if len(runs) == 5:
+            # a healthy run
+            clock.now += 100
+        if len(runs) == 9:
+            raise asyncio.CancelledError()
+        if len(runs) != 7:
+            raise RuntimeError("not primary")
+
+    monkeypatch.setattr(triggers, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    monkeypatch.setattr(triggers.asyncio, "sleep", sleep)
+    with pytest.raises(asyncio.CancelledError):
+        await watch_with_retry("Discovery", watch, db)
+    assert all(run is db for run in runs)
+    # a stream that ended without an error (7) restarts right away
+    assert delays == [1, 2, 4, 8, 1, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_watch_discovery_indexes_ready_while_running():
+    db = MockDatabase()
+    ready = []
+
+    def changes():
+        # the indexes as the trigger serves them while it reads the stream
+        ready.append([index.ready for index in (typeahead_index, creator_index, cluster_index)])
+        yield from ()
+
+    db["discovery"].changes = changes()
+    db["discovery"].documents = [change("insert", 1)["fullDocument"]]
+    await watch_discovery(db)
+    assert ready == [[True, True, True]]
+    # the stream ended, the endpoints query the database until the trigger is running again
+    assert [index.ready for index in (typeahead_index, creator_index, cluster_index)] == [False, False, False]
+    assert db["discovery"].streams[0].closed
+
+
+class OpenChangeStream(MockChangeStream):
+    """A change stream that stays open after its changes"""
+
+    async def __aiter__(self):
+        for change in self.changes:
+            yield change
+        await asyncio.Event().wait()
+
+
+@pytest.mark.asyncio
+async def test_watch_discovery_dead_letters():
+    db = MockDatabase()
+    bad = change("insert", "bad")
+    bad["fullDocument"]["name"] = 5
+    sparse = {"operationType": "insert", "documentKey": {"_id": "sparse"}, "fullDocument": {"_id": "sparse"}}
+    stream = OpenChangeStream([dict(event, _id={"_data": str(i)}) for i, event in enumerate([bad, sparse])])
+    db["discovery"].watch = lambda **kwargs: stream
+    failed = discovery_batch_stats.failed
+    task = asyncio.create_task(watch_discovery(db))
+    while not db["typeahead"].writes:
+        await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert [document["change"]["documentKey"] for document in db["trigger_dead_letters"].documents] == [{"_id": "bad"}]
+    assert db["typeahead"].writes == [
+        [ReplaceOne({"_id": "sparse"}, {"_id": "sparse", "name": "", "description": "", "keywords": []}, upsert=True)]
+    ]
+    assert discovery_batch_stats.failed == failed + 1
+    # the batch is acknowledged, the bad document does not stall the stream
+    assert await ResumeTokens(db["resume_tokens"]).load("discovery") == {"_data": "1"}
+    typeahead_index.remove("sparse")
+
+
+def test_discovery_watch_pipeline():
+    # inserts, replaces, deletes and updates that remove a field or set anything but the validators are delivered
+    (stage,) = DISCOVERY_WATCH_PIPELINE
+    inserts, removals, updates = stage["$match"]["$or"]
+    assert inserts == {"operationType": {"$ne": "update"}}
+    assert removals == {"updateDescription.removedFields.0": {"$exists": True}}
+    fields = updates["$expr"]["$gt"][0]["$size"]["$filter"]
+    assert fields["input"] == {"$objectToArray": "$updateDescription.updatedFields"}
+    assert fields["cond"] == {"$ne": ["$$field.k", LANDING_PAGE_FIELD]}
+
+
+@pytest.mark.asyncio
+async def test_reconcile_typeahead():
+    db = MockDatabase()
+    db["discovery"].documents = [change("insert", "a")["fullDocument"]]
+    db["typeahead"].documents = [{"_id": "a"}, {"_id": "orphan"}]
+
+    await reconcile_typeahead(db)
+    operations = [operation for write in db["typeahead"].writes for operation in write]
+    assert operations == [
+        ReplaceOne(
+            {"_id": "a"},
+            {"_id": "a", "name": "Soil moisture", "description": "At Reynolds Creek", "keywords": ["soil"]},
+            upsert=True,
+        ),
+        DeleteOne({"_id": "orphan"}),
+    ]
+    typeahead_index.remove("a")
+
+
+def submission_change(sequence, identifier):
+    return {
+        "_id": {"_data": sequence},
+        "operationType": "update",
+        "documentKey": {"_id": identifier},
+        "fullDocument": {"identifier": identifier},
+    }
+
+
+def test_watermark():
+    watermark = Watermark()
+    first, second, third = [watermark.add({"_data": i}) for i in range(3)]
+    watermark.done(second)
+    assert watermark.take() is None
+    watermark.done(first)
+    assert watermark.take() == {"_data": 1}
+    assert watermark.take() is None
+    watermark.done(third)
+    assert watermark.take() == {"_data": 2}
+
+
+@pytest.mark.asyncio
+async def test_process_changes_orders_per_key():
+    # the events of a key go to worker crc32(key) % workers
+    worker = {key: zlib.crc32(key.encode()) % 4 for key in ["slow", "a", "b", "c", "d", "e"]}
+    fast = next(key for key in ["b", "c", "d", "e"] if worker[key] != worker["slow"])
+    identifiers = ["slow", "a", "slow", fast, "a", "slow"]
+    changes = [submission_change(i, identifier) for i, identifier in enumerate(identifiers)]
+    processed = []
+    acknowledged = []
+
+    async def process(change):
+        identifier = change["documentKey"]["_id"]
+        await asyncio.sleep(0.05 if identifier == "slow" else 0)
+        processed.append((identifier, change["_id"]["_data"]))
+
+    async def acknowledge(token):
+        acknowledged.append(token["_data"])
+
+    await process_changes(MockChangeStream(changes), process, submission_key, 4, 10, acknowledge)
+    assert [sequence for identifier, sequence in processed if identifier == "slow"] == [0, 2, 5]
+    assert [sequence for identifier, sequence in processed if identifier == "a"] == [1, 4]
+    # the events of another worker did not wait for the slow ones
+    assert processed.index((fast, 3)) < processed.index(("slow", 0))
+    assert acknowledged == sorted(acknowledged)
+    assert acknowledged[-1] == 5
+
+
+@pytest.mark.asyncio
+async def test_process_changes_serial_lane():
+    deleted = {"_id": {"_data": 1}, "operationType": "delete", "documentKey": {"_id": "oid"}}
+    changes = [submission_change(0, "slow"), deleted, submission_change(2, "a")]
+    processed = []
+    acknowledged = []
+
+    async def process(change):
+        identifier = change["documentKey"]["_id"]
+        await asyncio.sleep(0.05 if identifier == "slow" else 0)
+        processed.append(identifier)
+
+    async def acknowledge(token):
+        acknowledged.append(token["_data"])
+
+    await process_changes(MockChangeStream(changes), process, submission_key, 4, 10, acknowledge)
+    # the delete may concern any identifier, it waits for the events before it and the events after it wait for it
+    assert processed == ["slow", "oid", "a"]
+    assert acknowledged == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_process_submission_change_delete_without_pre_image():
+    db = MockDatabase()
+    db["Submission"].documents = [{"identifier": "a"}]
+    db["discovery"].documents = [{"repository_identifier": "a"}, {"repository_identifier": "b"}]
+    deleted = {"_id": {"_data": 1}, "operationType": "delete", "documentKey": {"_id": "oid"}}
+    await process_submission_change(db, dict(deleted, fullDocumentBeforeChange=None))
+    assert db["discovery"].queries[-1] == {"repository_identifier": {"$in": ["b"]}, "legacy": False}
+
+
+@pytest.mark.asyncio
+async def test_process_changes_backpressure():
+    stream = MockChangeStream([submission_change(i, "a") for i in range(10)])
+    release = asyncio.Event()
+
+    async def process(change):
+        await release.wait()
+
+    async def acknowledge(token):
+        pass
+
+    task = asyncio.create_task(process_changes(stream, process, submission_key, 2, 2, acknowledge))
+    await asyncio.sleep(0.05)
+    # one event in the worker, two queued, one waiting to be queued
+    assert stream.read == 4
+    release.set()
+    await task
+    assert stream.read == 10
+
+
+@pytest.mark.asyncio
+async def test_process_changes_error():
+    attempts = []
+    acknowledged = []
+    dead_letters = []
+
+    async def process(change):
+        sequence = change["_id"]["_data"]
+        attempts.append(sequence)
+        # 1 always fails, 2 fails once
+        if sequence == 1 or attempts.count(sequence) == 1 and sequence == 2:
+            raise ValueError("landing page unavailable")
+
+    async def acknowledge(token):
+        acknowledged.append(token["_data"])
+
+    async def dead_letter(change, error):
+        dead_letters.append((change["_id"]["_data"], str(error)))
+
+    stream = MockChangeStream([submission_change(i, "a") for i in range(4)])
+    await process_changes(stream, process, submission_key, 2, 2, acknowledge, attempts=3, dead_letter=dead_letter)
+    # the failing event is set aside and the events after it are still processed and acknowledged
+    assert attempts == [0, 1, 1, 1, 2, 2, 3]
+    assert dead_letters == [(1, "landing page unavailable")]
+    assert acknowledged == [0, 1, 2, 3]
+
+    # without a dead letter callback the event is skipped
+    attempts.clear()
+    acknowledged.clear()
+    stream = MockChangeStream([submission_change(i, "a") for i in range(3)])
+    await process_changes(stream, process, submission_key, 2, 2, acknowledge)
+    assert attempts == [0, 1, 2]
+    assert acknowledged[-1] == 2
+
+
+def test_submission_key_and_latency():
+    assert submission_key(submission_change(0, "a")) == "a"
+    deleted = {"documentKey": {"_id": 1}, "fullDocument": None, "fullDocumentBeforeChange": {"identifier": "a"}}
+    assert submission_key(deleted) == "a"
+    # a delete without a pre-image
+    assert submission_key({"documentKey": {"_id": 1}, "fullDocumentBeforeChange": None}) is None
+
+    latency = LatencyStats()
+    assert latency.mean_seconds == 0.0
+    latency.record(1.0)
+    latency.record(3.0)
+    assert (latency.count, latency.mean_seconds, latency.max_seconds, latency.last_seconds) == (2, 2.0, 3.0, 3.0)
+    latency.failed += 1
+    assert latency.stats() == {"count": 2, "failed": 1, "mean_seconds": 2.0, "last_seconds": 3.0, "max_seconds": 3.0}
+
+
+@pytest.mark.asyncio
+async def test_process_changes_debounce():
+    changes = [submission_change(i, identifier) for i, identifier in enumerate(["a", "b", "a", "a", "b"])]
+    processed = []
+    acknowledged = []
+
+    async def process(change):
+        processed.append(change["_id"]["_data"])
+
+    async def acknowledge(token):
+        acknowledged.append(token["_data"])
+
+    await process_changes(MockChangeStream(changes), process, submission_key, 2, 10, acknowledge, window=0.05)
+    assert sorted(processed) == [3, 4]
+    assert acknowledged[-1] == 4
+
+
+@pytest.mark.asyncio
+async def test_process_changes_debounce_window():
+    async def spaced_changes():
+        for change in [submission_change(i, "a") for i in range(2)]:
+            yield change
+            await asyncio.sleep(0.1)
+
+    processed = []
+
+    async def process(change):
+        processed.append(change["_id"]["_data"])
+
+    async def acknowledge(token):
+        pass
+
+    await process_changes(spaced_changes(), process, submission_key, 2, 10, acknowledge, window=0.02)
+    assert processed == [0, 1]
+
+
+FRAGMENTS = list("aAbxZ09,-_ ()/.:\t\né ") + ["--", "http", "https://cznet.org/a(b)", "http://x", "Soil", "H2O"]
+
+
+@given(st.one_of(st.text(), st.lists(st.sampled_from(FRAGMENTS)).map("".join)))
+def test_sanitize_matches_regex_sanitize(text):
+    assert sanitize(text) == regex_sanitize(text)
+
+
+def test_sanitize():
+    text = "Data from https://www.hydroshare.org/ (Reynolds Creek) -- a soil/water b study -é- 2022\n x"
+    assert sanitize(text) == "Data from Reynolds Creek a soil water study 2022"
@@ -0,0 +1,168 @@
+import asyncio
+from collections import Counter
+
+import httpx
+import pytest
+
+from dspback.utils.vocabulary import LICENSE_SNAPSHOT, AwardVocabulary, LicenseVocabulary
+from tests import MockApi
+
+awards = {
+    "2012669": {
+        "id": "021nxhr62::2012669",
+        "number": "2012669",
+        "title": {"en": "Dynamic Water"},
+        "funder": {"name": "National Science Foundation"},
+    },
+    "2012123": {
+        "id": "021nxhr62::2012123",
+        "number": "2012123",
+        "title": {"en": "Big Data"},
+        "funder": {"name": "National Science Foundation"},
+    },
+}
+
+
+def awards_api(fail: set):
+    """Zenodo's award search, the numbers in fail time out"""
+
+    async def handler(request):
+        number = request.url.params["q"]
+        await asyncio.sleep(0.01)
+        if number in fail:
+            raise TimeoutError()
+        hits = [awards[number]] if number in awards else []
+        return httpx.Response(200, json={"hits": {"hits": hits}})
+
+    return MockApi(handler)
+
+
+def requested(api) -> Counter:
+    return Counter(request.url.params["q"] for request in api.requests)
+
+
+@pytest.mark.asyncio
+async def test_award_vocabulary_resolve():
+    vocabulary = AwardVocabulary()
+    api = awards_api(set())
+    client = api.client()
+    found = await vocabulary.resolve(client, ["2012669", "2012123", "2012669", "0000000", None])
+    assert found == {
+        "2012669": {
+            "id": "021nxhr62::2012669",
+            "number": "2012669",
+            "title": "Dynamic Water",
+            "fundingAgency": "National Science Foundation",
+        },
+        "2012123": {
+            "id": "021nxhr62::2012123",
+            "number": "2012123",
+            "title": "Big Data",
+            "fundingAgency": "National Science Foundation",
+        },
+    }
+    assert requested(api) == {"2012669": 1, "2012123": 1, "0000000": 1}
+
+    # warm, the found and the missing numbers are both cached
+    assert await vocabulary.resolve(client, ["2012669", "2012123", "0000000"]) == found
+    assert len(api.requests) == 3
+
+
+@pytest.mark.asyncio
+async def test_award_vocabulary_shares_and_does_not_cache_failures():
+    vocabulary = AwardVocabulary()
+    fail = {"2012123"}
+    api = awards_api(fail)
+    client = api.client()
+    results = await asyncio.gather(*[vocabulary.lookup(client, "2012669") for _ in range(5)])
+    assert results[0]["title"] == "Dynamic Water"
+    assert requested(api)["2012669"] == 1
+
+    assert await vocabulary.lookup(client, "2012123") is None
+    fail.clear()
+    assert (await vocabulary.lookup(client, "2012123"))["title"] == "Big Data"
+    assert requested(api)["2012123"] == 2
+
+
+@pytest.mark.asyncio
+async def test_award_vocabulary_negative_ttl():
+    now = [0]
+    vocabulary = AwardVocabulary(negative_ttl=10)
+    vocabulary.missing._timer = lambda: now[0]
+    api = awards_api(set())
+    client = api.client()
+    assert await vocabulary.lookup(client, "0000000") is None
+    assert await vocabulary.lookup(client, "0000000") is None
+    now[0] = 11
+    assert await vocabulary.lookup(client, "0000000") is None
+    assert requested(api)["0000000"] == 2
+
+
+def vocabulary_api(result):
+    """Zenodo's license vocabulary answering with result, or timing out without one"""
+
+    def handler(request):
+        if result is None:
+            raise TimeoutError()
+        return httpx.Response(200, json=result)
+
+    return MockApi(handler)
+
+
+glide = {
+    "id": "glide",
+    "title": {"en": "GLIDE"},
+    "description": {"en": "Glide license"},
+    "props": {"url": "https://example.org/glide"},
+}
+
+
+@pytest.mark.asyncio
+async def test_license_vocabulary_snapshot_and_refresh(tmp_path):
+    vocabulary = LicenseVocabulary()
+    # a failed refresh keeps the licenses already loaded
+    vocabulary.licenses = {"mit": {"id": "mit", "name": "MIT License", "description": "", "url": ""}}
+    assert not await vocabulary.refresh(vocabulary_api(None).client())
+    assert vocabulary.get("mit")
+    # callers get a copy
+    vocabulary.get("mit")["name"] = "changed"
+    assert vocabulary.get("mit")["name"] == "MIT License"
+
+    assert await vocabulary.refresh(vocabulary_api({"hits": {"hits": [glide]}}).client())
+    assert len(vocabulary) == 1
+    assert vocabulary.get("glide") == {
+        "id": "glide",
+        "name": "GLIDE",
+        "description": "Glide license",
+        "url": "https://example.org/glide",
+    }
+    assert vocabulary.get("mit") is None
+
+    vocabulary.save_snapshot(tmp_path / "licenses.json")
+    reloaded = LicenseVocabulary()
+    reloaded.load_snapshot(tmp_path / "licenses.json")
+    assert reloaded.licenses == vocabulary.licenses
+
+    # the bundled snapshot is written by the refresh script
+    bundled = LicenseVocabulary()
+    bundled.load_snapshot()
+    assert len(bundled) > 100
+    assert bundled.get("cc-by-4.0")["name"] == "Creative Commons Attribution 4.0 International"
+    assert bundled.get("cc-by-4.0")["url"] == "https://creativecommons.org/licenses/by/4.0/"
+    bundled.save_snapshot(tmp_path / "bundled.json")
+    assert (tmp_path / "bundled.json").read_text() == LICENSE_SNAPSHOT.read_text()
+
+
+@pytest.mark.asyncio
+async def test_license_vocabulary_lookup():
+    vocabulary = LicenseVocabulary()
+    api = vocabulary_api(glide)
+    client = api.client()
+    assert (await vocabulary.lookup(client, "glide"))["description"] == "Glide license"
+    assert await vocabulary.lookup(client, "glide") == vocabulary.get("glide")
+    assert [str(request.url) for request in api.requests] == ["https://zenodo.org/api/vocabularies/licenses/glide"]
+
+    # licenses Zenodo does not know and failed lookups are not kept
+    assert await vocabulary.lookup(vocabulary_api({"status": 404}).client(), "not-a-license") is None
+    assert await vocabulary.lookup(vocabulary_api(None).client(), "mit") is None
+    assert len(vocabulary) == 1
@@ -0,0 +1,48 @@
+import json
+
+import httpx
+import pytest
+
+from dspback.config import get_settings
+from dspback.pydantic_schemas import RepositoryType
+from dspback.routers.earthchem import EarthChemMetadataRoutes
+from dspback.routers.zenodo import ZenodoMetadataRoutes
+from dspback.utils.vocabulary import award_vocabulary, license_vocabulary
+from tests import metadata_routes, mock_repository
+
+
+@pytest.mark.asyncio
+async def test_earthchem_write_through(metadata_routes):
+    earthchem_routes, submitted = metadata_routes(EarthChemMetadataRoutes)
+    record = {"title": "Record", "status": "published", "contributors": [{"givenName": "A", "identifiers": None}]}
+    response = httpx.Response(201, json=record)
+
+    json_metadata = await earthchem_routes._write_through(None, "1", response)
+    assert json_metadata["published"]
+    assert json_metadata["metadata"]["leadAuthor"] == {"givenName": "A", "identifiers": []}
+    assert submitted == [("1", json_metadata["metadata"])]
+
+    # a response without the record is read back instead
+    assert await earthchem_routes._write_through(None, "1", httpx.Response(201, json={"id": "1"})) is None
+    assert await earthchem_routes._write_through(None, "1", httpx.Response(204)) is None
+    earthchem_routes.settings = get_settings().copy(update={"repository_write_through": False})
+    assert await earthchem_routes._write_through(None, "1", response) is None
+    assert len(submitted) == 1
+
+
+@pytest.mark.asyncio
+async def test_zenodo_write_through(monkeypatch, mock_repository, metadata_routes):
+    mit = {"id": "mit", "title": {"en": "MIT License"}, "description": {"en": "A short permissive license"}}
+    api = mock_repository(RepositoryType.ZENODO, lambda request: httpx.Response(200, json=mit))
+    monkeypatch.setattr(license_vocabulary, "licenses", {})
+    zenodo_routes, submitted = metadata_routes(ZenodoMetadataRoutes)
+    deposition = {"record_id": 1, "metadata": {"title": "Record", "license": "mit", "grants": []}}
+    await award_vocabulary.clear()
+
+    json_metadata = await zenodo_routes._write_through(None, 1, json.loads(json.dumps(deposition)))
+    assert json_metadata["metadata"]["title"] == "Record"
+    assert json_metadata["metadata"]["license"]["name"] == "MIT License"
+    assert json_metadata["metadata"]["license"]["description"] == "A short permissive license"
+    assert not json_metadata["published"]
+    assert [identifier for identifier, _ in submitted] == [1]
+    assert [request.url.path for request in api.requests] == ["/api/vocabularies/licenses/mit"]